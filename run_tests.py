@@ -259,6 +259,34 @@ async def test_http_request(results: TestResults):
     except Exception as e:
         results.fail_test("HTTP запрос", str(e))
 
+async def test_meaningful_change(results: TestResults):
+    """Тест 7: Фильтр незначимых изменений (даты/версии)"""
+    print("\n[7] Тест 7: Фильтр незначимых изменений")
+    print("-" * 40)
+    
+    try:
+        from src.tg.handlers import _is_meaningful_change
+        
+        # (было, стало, ожидаемая значимость)
+        cases = [
+            # «2.1 march 2025»: дата «1 march 2025» пересекается с версией «2.1» —
+            # даты вырезаются первыми, поэтому разница только в дате
+            ("terms version 2.1 march 2025", "terms version 2.1 april 2025", False),
+            ("updated on 5 jan 2024 policy text", "updated on 12 feb 2025 policy text", False),
+            ("advertising policy v1.2 applies", "advertising policy v1.3 applies", False),
+            ("ads about alcohol are allowed", "ads about alcohol are prohibited", True),
+        ]
+        for was, now, expected in cases:
+            detail = {"global_diff": {"changed": [{"was": was, "now": now}], "added": [], "removed": []}}
+            got = _is_meaningful_change(detail)
+            if got == expected:
+                results.pass_test(f"Значимость: {now!r}")
+            else:
+                results.fail_test(f"Значимость: {now!r}", f"Ожидалось {expected}, получено {got}")
+    
+    except Exception as e:
+        results.fail_test("Фильтр незначимых изменений", str(e))
+
 async def run_all_tests():
     """Запускает все тесты"""
     print("[TEST] ЗАПУСК КОМПЛЕКСНОГО ТЕСТИРОВАНИЯ META NEWS BOT")
@@ -274,6 +302,7 @@ async def run_all_tests():
     await test_url_processing(results)
     await test_regional_grouping(results)
     await test_http_request(results)
+    await test_meaningful_change(results)
     
     # Показываем итоговые результаты
     success = results.summary()
@@ -30,7 +30,7 @@ def backup_to_gist(data: dict) -> bool:
         payload = {
             "files": {
                 "cache.json": {
-                    "content": json.dumps(data, ensure_ascii=False, indent=2)
+                    "content": json.dumps(data, ensure_ascii=False, separators=(",", ":"))
                 }
             }
         }
@@ -8,6 +8,7 @@
 """
 from __future__ import annotations
 
+import os
 import re
 from typing import Tuple, Iterable
 
@@ -27,12 +28,32 @@ _UPDATED_PATTERNS: Iterable[re.Pattern[str]] = [
 ]
 
 
+# предел длины cleaned_html (отладочный HTML не должен раздувать память)
+CLEANED_HTML_LIMIT = 100000
+# cleaned_html в clean_html строим только для отладки: сериализация всего дерева дорогая
+CLEANED_HTML_DEBUG = os.getenv("CLEANED_HTML_DEBUG", "0") == "1"
+
+
 def clean_html(html: str, url: str) -> Tuple[str, str, str]:
     """
     Возвращает (title, plain_text, cleaned_html_for_debug)
     plain_text — стабилизированный текст для хэширования/суммаризации.
+    cleaned_html — только при CLEANED_HTML_DEBUG=1, иначе пустая строка.
+    """
+    title, text, soup = clean_html_soup(html, url)
+    # trimmed debug html (не обязателен, но полезно иметь)
+    cleaned_html = str(soup)[:CLEANED_HTML_LIMIT] if CLEANED_HTML_DEBUG else ""  # ограничим, чтобы не раздувать память
+    return title, text, cleaned_html
+
+
+def clean_html_soup(html: str, url: str) -> Tuple[str, str, BeautifulSoup]:
+    """
+    То же, что clean_html, но вместо строки возвращает очищенное дерево —
+    чтобы дальше (extract_sections) не парсить HTML второй раз.
     """
     try:
+        # html.parser, а не lxml: парсеры по-разному чинят битую разметку, а от дерева
+        # зависят хэши страниц и сигнатуры секций в cache.json (смена = ложные «изменения»)
         soup = BeautifulSoup(html or "", "html.parser")
     except FeatureNotFound:
         # fallback
@@ -66,7 +87,4 @@ def clean_html(html: str, url: str) -> Tuple[str, str, str]:
     text = _MULTI_NL_RE.sub("\n\n", text)
     text = text.strip()
 
-    # trimmed debug html (не обязателен, но полезно иметь)
-    cleaned_html = str(soup)[:100000]  # ограничим, чтобы не раздувать память
-
-    return title, text, cleaned_html
+    return title, text, soup
@@ -1,7 +1,8 @@
 # -*- coding: utf-8 -*-
 import asyncio, logging
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from .pipeline import run_update
+from .pipeline import run_update, aclose_http_clients
+from . import telegram_notify
 
 logging.basicConfig(level=logging.INFO)
 
@@ -22,3 +23,6 @@ if __name__ == "__main__":
         loop.run_forever()
     except KeyboardInterrupt:
         pass
+    finally:
+        loop.run_until_complete(aclose_http_clients())
+        loop.run_until_complete(telegram_notify.aclose())
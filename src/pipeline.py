@@ -3,15 +3,26 @@ import logging
 import os
 import json
 import time
+import heapq
 import random
+import sqlite3
 from datetime import datetime, timezone
 from typing import Dict, List, Tuple, Any, Optional
+from urllib.parse import urlparse
+from urllib.request import getproxies, proxy_bypass_environment
+from functools import lru_cache
 
 import asyncio
 import httpx
-from difflib import SequenceMatcher
+from collections import Counter
 import re
 
+# cydifflib — тот же difflib, собранный Cython: ratio() побайтно совпадает, но в разы быстрее
+try:
+    from cydifflib import SequenceMatcher
+except ImportError:
+    from difflib import SequenceMatcher
+
 # Импорт curl-cffi для обхода TLS fingerprinting
 try:
     from curl_cffi.requests import AsyncSession
@@ -20,28 +31,200 @@ except ImportError:
     CURL_CFFI_AVAILABLE = False
     AsyncSession = None
 
+# rapidfuzz (C++) — быстрая верхняя оценка для SequenceMatcher.ratio()
+try:
+    from rapidfuzz.distance import Indel as _Indel
+    RAPIDFUZZ_AVAILABLE = True
+except ImportError:
+    RAPIDFUZZ_AVAILABLE = False
+    _Indel = None
+
 from .storage import load_cache, save_cache, compute_hash, get_cache_stats
 from .config import (
     PROJECT_ROOT, SOURCES, USE_PROXY, PROXY_URL, PROXY_URL_EU,
     PROXY_PROVIDER, PROXY_STICKY, PROXY_FALLBACK_EU,
-    SOCKS5_URL, SOCKS5_URL_EU, HTTP_TUNNEL_URL
+    SOCKS5_URL, SOCKS5_URL_EU, HTTP_TUNNEL_URL, selectors_for
 )
-from .html_clean import clean_html
+from .html_clean import clean_html_soup, CLEANED_HTML_LIMIT
 from .summarize import summarize_rules, normalize_plain, extract_sections
 
 log = logging.getLogger(__name__)
 
-TRANS_CACHE_FILE = PROJECT_ROOT / "data" / "trans_cache.json"
-if TRANS_CACHE_FILE.exists():
+# Кэш резюме: page_sig -> summary. Хранится в SQLite (запись — одна строка на новое
+# резюме, без перезаписи всего файла), в памяти — L1 для уже прочитанных ключей.
+TRANS_CACHE_FILE = PROJECT_ROOT / "data" / "trans_cache.json"  # старый формат, импортируется один раз
+TRANS_CACHE_DB = TRANS_CACHE_FILE.with_suffix(".db")
+trans_cache: Dict[str, str] = {}
+
+def _open_trans_db() -> Optional[sqlite3.Connection]:
     try:
-        trans_cache: Dict[str, str] = json.loads(TRANS_CACHE_FILE.read_text(encoding="utf-8"))
-    except Exception:
-        trans_cache = {}
-else:
-    trans_cache = {}
+        TRANS_CACHE_DB.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(str(TRANS_CACHE_DB), isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS trans_cache (h TEXT PRIMARY KEY, summary TEXT NOT NULL)")
+        # ✅ миграция: пустая база + есть trans_cache.json -> переносим записи
+        if TRANS_CACHE_FILE.exists() and conn.execute("SELECT 1 FROM trans_cache LIMIT 1").fetchone() is None:
+            try:
+                old = json.loads(TRANS_CACHE_FILE.read_text(encoding="utf-8"))
+                rows = [(k, v) for k, v in old.items() if isinstance(v, str)] if isinstance(old, dict) else []
+                conn.execute("BEGIN")
+                conn.executemany("INSERT OR REPLACE INTO trans_cache (h, summary) VALUES (?, ?)", rows)
+                conn.execute("COMMIT")
+                log.info(f"🗄️ trans_cache.json импортирован в SQLite: {len(rows)} записей")
+            except Exception as e:
+                log.error("Не удалось импортировать trans_cache.json: %s", e)
+        return conn
+    except Exception as e:
+        log.error("SQLite кэш переводов недоступен, работаем только в памяти: %s", e)
+        return None
+
+_trans_db = _open_trans_db()
+
+def _trans_get(sig: str) -> Optional[str]:
+    summary = trans_cache.get(sig)
+    if summary is None and _trans_db is not None:
+        try:
+            row = _trans_db.execute("SELECT summary FROM trans_cache WHERE h = ?", (sig,)).fetchone()
+        except Exception as e:
+            log.error("Ошибка чтения кэша переводов: %s", e)
+            row = None
+        if row is not None:
+            summary = trans_cache[sig] = row[0]
+    return summary
+
+def _trans_put(sig: str, summary: str) -> None:
+    trans_cache[sig] = summary
+    if _trans_db is not None:
+        try:
+            _trans_db.execute("INSERT OR REPLACE INTO trans_cache (h, summary) VALUES (?, ?)", (sig, summary))
+        except Exception as e:
+            log.error("Не удалось сохранить кэш переводов: %s", e)
 
 TIMEOUT = httpx.Timeout(30.0, connect=15.0)  # Увеличили timeout
 
+# маркеры страниц блокировки/челленджа: Facebook rate limit, Cloudflare.
+# Новый маркер — просто добавить в кортеж: поиск всё равно один проход по байтам
+_BLOCK_MARKERS = (
+    b"You're Temporarily Blocked",
+    b"going too fast",
+    b"Checking your browser before accessing",
+    b"Cloudflare Ray ID",
+)
+_BLOCK_RE = re.compile(b"|".join(re.escape(m) for m in _BLOCK_MARKERS))
+_BLOCK_OVERLAP = max(map(len, _BLOCK_MARKERS)) - 1  # маркер может попасть на стык чанков
+_STREAM_CHUNK = 65536
+
+# Пулы соединений живут между запросами и прогонами: TCP/TLS (и CONNECT к прокси)
+# не поднимаются заново на каждый источник. Ключ — (URL прокси, verify).
+_HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50, keepalive_expiry=75)
+_transports: Dict[Tuple[Optional[str], bool], httpx.AsyncHTTPTransport] = {}
+_transports_loop: Optional[asyncio.AbstractEventLoop] = None
+_transports_closing: set = set()  # задачи закрытия пулов прежнего loop (держим ссылки до завершения)
+
+class _SharedTransport(httpx.AsyncBaseTransport):
+    """Общий пул для лёгкого клиента: закрытие клиента пул не закрывает (его закрывает aclose_http_clients)."""
+
+    def __init__(self, transport: httpx.AsyncHTTPTransport):
+        self._transport = transport
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        return await self._transport.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        pass
+
+@lru_cache(maxsize=1)
+def _env_proxies() -> Dict[str, str]:
+    """HTTP(S)_PROXY / ALL_PROXY / NO_PROXY из окружения (читаем один раз, после загрузки .env)."""
+    return getproxies()
+
+def _env_proxy_for(url: str) -> Optional[str]:
+    """
+    Прокси из окружения для url — как делал httpx с trust_env. С общим transport= httpx
+    переменные окружения сам не смотрит, поэтому разрешаем их здесь.
+    """
+    env = _env_proxies()
+    if not env:
+        return None
+    parsed = urlparse(url)
+    if proxy_bypass_environment(parsed.hostname or "", env):  # NO_PROXY
+        return None
+    proxy = env.get(parsed.scheme) or env.get("all")
+    if proxy and "://" not in proxy:
+        proxy = "http://" + proxy  # как в httpx: «host:port» без схемы — HTTP-прокси
+    return proxy or None
+
+def _http_client(proxies: Optional[Dict[str, str]], verify: bool, url: str = "") -> httpx.AsyncClient:
+    """
+    Лёгкий клиент поверх общего пула соединений — использовать как `async with`.
+    Куки у каждого клиента свои — как и раньше, между запросами они не переносятся.
+    Закрытие клиента общий пул не трогает (см. _SharedTransport, aclose_http_clients).
+    Без явного прокси берётся прокси из окружения для url (HTTP(S)_PROXY/ALL_PROXY с учётом NO_PROXY).
+    """
+    global _transports_loop
+    loop = asyncio.get_running_loop()
+    if _transports_loop is not loop:
+        # соединения привязаны к event loop — со старого loop их не переиспользовать;
+        # прежние пулы закрываем в фоне (ошибки закрытия на завершённом loop глушатся)
+        if _transports:
+            task = loop.create_task(_aclose_transports(list(_transports.values())))
+            _transports_closing.add(task)
+            task.add_done_callback(_transports_closing.discard)
+        _transports.clear()
+        _transports_loop = loop
+    proxy_url = (proxies or {}).get("https://") or (proxies or {}).get("http://")
+    if proxy_url is None:
+        proxy_url = _env_proxy_for(url)
+    key = (proxy_url, bool(verify))
+    transport = _transports.get(key)
+    if transport is None:
+        transport = _transports[key] = httpx.AsyncHTTPTransport(
+            verify=verify,
+            proxy=httpx.Proxy(proxy_url) if proxy_url else None,
+            limits=_HTTP_LIMITS,
+        )
+    # прокси уже выбран выше; trust_env с transport= на прокси не влияет (httpx не смотрит окружение)
+    return httpx.AsyncClient(transport=_SharedTransport(transport), timeout=TIMEOUT, follow_redirects=True)
+
+def _buffered_response(r: httpx.Response, body: bytes) -> httpx.Response:
+    """Обычный (прочитанный) Response из уже раскодированного тела потокового ответа."""
+    # тело уже распаковано — заголовки кодирования/длины к нему не относятся
+    headers = [(k, v) for k, v in r.headers.raw
+               if k.lower() not in (b"content-encoding", b"content-length", b"transfer-encoding")]
+    return httpx.Response(r.status_code, headers=headers, content=body, request=r.request)
+
+async def _get_streamed(client: httpx.AsyncClient, url: str, headers: Dict[str, str]) -> Tuple[httpx.Response, bool]:
+    """
+    GET с потоковым чтением тела. Для 2xx каждый чанк сразу проверяется на маркер
+    блокировки — при совпадении загрузка обрывается (HTTPStatusError "Temporary block").
+    Возвращает (response, scanned): scanned=True — тело уже проверено на блокировку.
+    """
+    async with client.stream("GET", url, headers=headers) as r:
+        scan = r.status_code < 300
+        buf = bytearray()
+        async for chunk in r.aiter_bytes(_STREAM_CHUNK):
+            if scan and (_BLOCK_RE.search(chunk) or
+                         _BLOCK_RE.search(bytes(buf[-_BLOCK_OVERLAP:]) + chunk[:_BLOCK_OVERLAP])):
+                buf += chunk
+                resp = _buffered_response(r, bytes(buf))
+                raise httpx.HTTPStatusError("Temporary block", request=resp.request, response=resp)
+            buf += chunk
+        return _buffered_response(r, bytes(buf)), scan
+
+async def _aclose_transports(transports: List[httpx.AsyncHTTPTransport]) -> None:
+    for transport in transports:
+        try:
+            await transport.aclose()
+        except Exception as e:
+            log.debug("transport close failed: %s", e)
+
+async def aclose_http_clients() -> None:
+    """Закрывает общие пулы соединений (при остановке процесса)."""
+    transports = list(_transports.values())
+    _transports.clear()
+    await _aclose_transports(transports)
+
 # Языковые настройки по регионам (для Accept-Language)
 _DEFAULT_LANG_BY_REGION = {
     "EU": "en-GB,en;q=0.9",
@@ -49,6 +232,25 @@ _DEFAULT_LANG_BY_REGION = {
     "GLOBAL": "en-US,en;q=0.9",
 }
 
+# region -> {"http://": url, "https://": url}, заполняется при первом обращении
+_PROXY_BY_REGION: Dict[str, Dict[str, str]] = {}
+
+def _proxy_base_url(region: str) -> Optional[str]:
+    """URL прокси для региона. Приоритет SOCKS5 над HTTP (для обхода блокировок Railway)."""
+    if region == "MD" and SOCKS5_URL:
+        return SOCKS5_URL
+    if region == "EU" and SOCKS5_URL_EU:
+        return SOCKS5_URL_EU
+    if SOCKS5_URL:
+        return SOCKS5_URL
+    if region == "MD" and PROXY_URL:
+        return PROXY_URL
+    if region == "EU" and PROXY_URL_EU:
+        return PROXY_URL_EU
+    if PROXY_URL:
+        return PROXY_URL
+    return None
+
 def _get_proxy_for_region(region: str, proxy_country: Optional[str] = None, session_id: Optional[str] = None) -> Optional[Dict[str, str]]:
     """
     Возвращает настройки прокси для httpx в зависимости от региона источника.
@@ -58,52 +260,31 @@ def _get_proxy_for_region(region: str, proxy_country: Optional[str] = None, sess
     - proxy_country: переопределение страны для прокси (из config.json источника)
     - session_id: для sticky-сессий (Froxy поддерживает session=<rand>)
     """
-    log.debug(f"🔍 DEBUG: _get_proxy_for_region({region}, USE_PROXY={USE_PROXY}, PROXY_URL={bool(PROXY_URL)}, PROXY_URL_EU={bool(PROXY_URL_EU)})")
+    if log.isEnabledFor(logging.DEBUG):
+        log.debug(f"🔍 DEBUG: _get_proxy_for_region({region}, USE_PROXY={USE_PROXY}, PROXY_URL={bool(PROXY_URL)}, PROXY_URL_EU={bool(PROXY_URL_EU)})")
     
     if not USE_PROXY:
-        log.debug(f"🚫 USE_PROXY=False, возвращаем None")
+        log.debug("🚫 USE_PROXY=False, возвращаем None")
         return None
     
-    # Приоритет SOCKS5 над HTTP (для обхода блокировок Railway)
-    if region == "MD" and SOCKS5_URL:
-        base_url = SOCKS5_URL
-        is_socks = True
-    elif region == "EU" and SOCKS5_URL_EU:
-        base_url = SOCKS5_URL_EU
-        is_socks = True
-    elif SOCKS5_URL:
-        base_url = SOCKS5_URL
-        is_socks = True
-    elif region == "MD" and PROXY_URL:
-        base_url = PROXY_URL
-        is_socks = False
-    elif region == "EU" and PROXY_URL_EU:
-        base_url = PROXY_URL_EU
-        is_socks = False
-    elif PROXY_URL:
-        base_url = PROXY_URL
-        is_socks = False
-    else:
+    base_url = _proxy_base_url(region)
+    if base_url is None:
         return None
     
-    # Обработка Froxy прокси
-    if PROXY_PROVIDER == "froxy":
-        if PROXY_STICKY and session_id:
-            # Добавляем session для sticky сессий
-            modified_url = base_url.replace("@proxy.froxy.com", f":session={session_id}@proxy.froxy.com")
+    # Froxy sticky: session меняется от прогона к прогону — собираем URL на лету
+    if PROXY_PROVIDER == "froxy" and PROXY_STICKY and session_id:
+        modified_url = base_url.replace("@proxy.froxy.com", f":session={session_id}@proxy.froxy.com")
+        if log.isEnabledFor(logging.DEBUG):
             log.debug(f"🔐 Froxy sticky session: region={region}, session={session_id}")
-            return {"http://": modified_url, "https://": modified_url}
-        else:
-            log.debug(f"🔐 Froxy прокси: region={region}")
-            return {"http://": base_url, "https://": base_url}
-    elif PROXY_PROVIDER == "brightdata":
-        # Bright Data прокси: session уже в URL, просто возвращаем
-        log.debug(f"🔐 Bright Data прокси: region={region}")
-        return {"http://": base_url, "https://": base_url}
-    else:
-        # Другие прокси-провайдеры
+        return {"http://": modified_url, "https://": modified_url}
+    
+    # Без sticky-сессии настройки по региону неизменны — отдаём готовый dict (только для чтения)
+    proxies = _PROXY_BY_REGION.get(region)
+    if proxies is None:
+        proxies = _PROXY_BY_REGION[region] = {"http://": base_url, "https://": base_url}
+    if log.isEnabledFor(logging.DEBUG):
         log.debug(f"🔐 Прокси: region={region}, provider={PROXY_PROVIDER}")
-        return {"http://": base_url, "https://": base_url}
+    return proxies
 
 
 # Ротация User-Agent для более реалистичного поведения
@@ -115,11 +296,18 @@ USER_AGENTS = [
     "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) AppleWebKit/605.1.15 (KHTML, like Gecko) Version/17.6 Safari/605.1.15",
 ]
 
+# Сайты Meta (JS-редиректы, 422 с рабочим HTML): одна regex-альтернатива вместо any() по списку.
+# developers.facebook.com покрывается facebook.com
+_META_HOSTS_RE = re.compile(r"facebook\.com|transparency\.meta\.com|about\.fb\.com")
+
+def _is_meta_site(url: str) -> bool:
+    return _META_HOSTS_RE.search(url) is not None
+
 def _fix_facebook_url(url: str) -> str:
     """
     Добавляет параметр _fb_noscript=1 к Facebook/Meta URL для обхода JavaScript редиректов
     """
-    if any(domain in url for domain in ["facebook.com", "transparency.meta.com", "about.fb.com", "developers.facebook.com"]):
+    if _is_meta_site(url):
         # Проверяем если параметр уже есть
         if "_fb_noscript=1" not in url:
             # Добавляем параметр
@@ -172,9 +360,10 @@ async def _fetch_with_curl_cffi(url: str, headers: dict, proxies: Optional[dict]
         )
         return CurlCffiResponse(response)
 
-def _get_random_headers(url: str = "", accept_lang: Optional[str] = None):
-    """Генерирует случайные заголовки для каждого запроса"""
-    ua = random.choice(USER_AGENTS)
+def _get_random_headers(url: str = "", accept_lang: Optional[str] = None,
+                        rng: Optional[random.Random] = None):
+    """Генерирует случайные заголовки для каждого запроса (rng — ГСЧ прогона, по умолчанию модуль random)"""
+    ua = (rng or random).choice(USER_AGENTS)
     headers = {
         "User-Agent": ua,
         "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8",
@@ -194,7 +383,7 @@ def _get_random_headers(url: str = "", accept_lang: Optional[str] = None):
     }
     
     # Специальные заголовки для Meta/Facebook сайтов
-    if any(domain in url for domain in ["facebook.com", "transparency.meta.com", "about.fb.com", "developers.facebook.com"]):
+    if _is_meta_site(url):
         headers["Referer"] = "https://www.google.com/"
         headers["Sec-Fetch-Site"] = "cross-site"
         headers["Accept"] = "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8"
@@ -216,60 +405,155 @@ FETCH_RETRY_BACKOFF = float(os.getenv("FETCH_RETRY_BACKOFF", "1.2"))
 
 LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "2"))
 LLM_MIN_INTERVAL = float(os.getenv("LLM_MIN_INTERVAL", "0.3"))
+# сколько хостов качаем одновременно (внутри хоста запросы всегда последовательны)
+FETCH_CONCURRENCY = max(1, int(os.getenv("FETCH_CONCURRENCY", "4")))
+# выше этого числа пар old×new дифф считается по выравниванию блоков, а не полным перебором
+PAIR_CELL_LIMIT = int(os.getenv("PAIR_CELL_LIMIT", "250000"))
+# воркеры стадии разбора/суммаризации в run_update (по умолчанию = лимиту LLM)
+PIPELINE_WORKERS = max(1, int(os.getenv("PIPELINE_WORKERS", str(LLM_MAX_CONCURRENCY))))
 
 # опциональная очистка кэша от удалённых источников (по умолчанию ВКЛ)
 PRUNE_REMOVED_SOURCES = os.getenv("PRUNE_REMOVED_SOURCES", "1") == "1"
 
 _llm_sem = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
-_llm_lock = asyncio.Lock()
-_last_llm_ts: float = 0.0
+_last_llm_ts: float = 0.0  # время старта последнего (или уже запланированного) LLM-вызова
 
-_SENT_SPLIT_RE = r"(?<=[\.\!\?\n])\s+"
+_SENT_SPLIT_RE = re.compile(r"(?<=[\.\!\?\n])\s+")
+_WS_RE = re.compile(r"\s+")
+# символы, которые срезаем по краям предложения (буллеты, тире, nbsp)
+_STRIP_CHARS = " -–—•\u00a0\t"
 
 def _split_sentences(text: str) -> List[str]:
     t = (text or "").strip()
     if not t:
         return []
-    t = re.sub(r"\s+", " ", t)
-    parts = re.split(_SENT_SPLIT_RE, t)
+    # isprintable() ложно для любого пробельного символа, кроме ASCII-пробела,
+    # так что для уже чистого текста regex-проход можно пропустить
+    if "  " in t or not t.isprintable():
+        t = _WS_RE.sub(" ", t)
+    stripped = (p.strip(_STRIP_CHARS) for p in _SENT_SPLIT_RE.split(t))
+    return [p for p in stripped if len(p) >= 2]
+
+def _multiset_only(sents: List[str], extra: Counter) -> List[str]:
+    """Вхождения из sents, которых нет у другой стороны (с учётом кратности, порядок сохраняется)."""
     out = []
-    for p in parts:
-        p = p.strip(" -–—•\u00a0\t")
-        if len(p) >= 2:
-            out.append(p)
+    for s in sents:
+        if extra[s] > 0:
+            extra[s] -= 1
+            out.append(s)
     return out
 
 def _pair_changed_sentences(old_sents: List[str], new_sents: List[str], threshold: float = 0.0):
-    matched_pairs: List[Tuple[str, str]] = []
-    old_set = set(old_sents)
-    new_set = set(new_sents)
-    same = old_set & new_set
+    old_counts, new_counts = Counter(old_sents), Counter(new_sents)
+    old_extra, new_extra = old_counts - new_counts, new_counts - old_counts
+
+    # гигантская переписанная страница: перебор всех пар old×new слишком дорог
+    if sum(old_extra.values()) * sum(new_extra.values()) > PAIR_CELL_LIMIT:
+        return _pair_by_alignment(old_sents, new_sents, old_extra, new_extra, threshold)
+
+    # разность мультимножеств: повтор "Foo" дважды в old и один раз в new — одно удаление
+    old_only = _multiset_only(old_sents, old_extra)
+    new_only = _multiset_only(new_sents, new_extra)
+    return _match_fuzzy(old_only, new_only, threshold)
+
+def _pair_by_alignment(old_sents: List[str], new_sents: List[str],
+                       old_extra: Counter, new_extra: Counter, threshold: float):
+    """
+    Приближённое сопоставление для очень больших диффов: выравниваем списки предложений
+    (опкоды SequenceMatcher по целым предложениям) и ищем пары только внутри блоков
+    replace. Совпавшие где-то ещё (переставленные) предложения по-прежнему не попадают
+    в дифф — вычитаем их через old_extra/new_extra.
+    """
+    pairs: List[Tuple[str, str]] = []
+    old_rest: List[str] = []
+    new_rest: List[str] = []
+    sm = SequenceMatcher(None, old_sents, new_sents, autojunk=False)
+    for op, i1, i2, j1, j2 in sm.get_opcodes():
+        if op == "equal":
+            continue
+        block_old = _multiset_only(old_sents[i1:i2], old_extra)
+        block_new = _multiset_only(new_sents[j1:j2], new_extra)
+        if not block_old or not block_new:
+            old_rest.extend(block_old)
+            new_rest.extend(block_new)
+        elif len(block_old) * len(block_new) <= PAIR_CELL_LIMIT:
+            p, o, n = _match_fuzzy(block_old, block_new, threshold)
+            pairs.extend(p)
+            old_rest.extend(o)
+            new_rest.extend(n)
+        else:
+            # блок целиком переписан — сопоставляем по позиции
+            k = min(len(block_old), len(block_new))
+            pairs.extend(zip(block_old[:k], block_new[:k]))
+            old_rest.extend(block_old[k:])
+            new_rest.extend(block_new[k:])
+    return pairs, old_rest, new_rest
 
-    old_only = [s for s in old_sents if s not in same]
-    new_only = [s for s in new_sents if s not in same]
+def _match_fuzzy(old_only: List[str], new_only: List[str], threshold: float):
+    """Жадно сопоставляет каждому old лучший по ratio() ещё свободный new."""
+    matched_pairs: List[Tuple[str, str]] = []
 
-    used_new_idx: set[int] = set()
-    for s_old in old_only:
+    # флаги «уже сопоставлено» — bytearray: индексация без хэширования
+    used_new = bytearray(len(new_only))
+    paired_old = bytearray(len(old_only))
+    new_lens = [len(s) for s in new_only]
+    # SequenceMatcher по каждому new-предложению: индекс b2j строится один раз на b,
+    # для очередного old меняется только seq1 (ratio() несимметричен — роли a/b не меняем)
+    matchers: List[Optional[SequenceMatcher]] = [None] * len(new_only)
+    for i, s_old in enumerate(old_only):
         best_j = -1
         best_score = 0.0
+        la = len(s_old)
         for j, s_new in enumerate(new_only):
-            if j in used_new_idx:
+            if used_new[j]:
+                continue
+            # ratio() <= 2*min(la, lb)/(la+lb): если даже эта граница не лучше
+            # текущего best_score, пара точно не победит — ratio() не считаем
+            lb = new_lens[j]
+            if la + lb and 2.0 * min(la, lb) / (la + lb) <= best_score:
+                continue
+            # Indel-сходство (по LCS) тоже не меньше ratio(): блоки SequenceMatcher —
+            # общая подпоследовательность. Считается в C++, отсекает почти всех кандидатов
+            if _Indel is not None and _Indel.normalized_similarity(s_old, s_new) + 1e-9 <= best_score:
+                continue
+            sm = matchers[j]
+            if sm is None:
+                sm = matchers[j] = SequenceMatcher(None, b=s_new)
+            sm.set_seq1(s_old)
+            # quick_ratio() (пересечение мультимножеств символов) — тоже верхняя граница
+            # ratio(); нужна, только если нет более точной Indel-оценки из rapidfuzz
+            if _Indel is None and sm.quick_ratio() <= best_score:
                 continue
-            score = SequenceMatcher(None, s_old, s_new).ratio()
+            score = sm.ratio()
             if score > best_score:
                 best_score = score
                 best_j = j
+                if score >= 1.0:
+                    break  # лучше точного совпадения не бывает
         if best_score > threshold and best_j >= 0:
             matched_pairs.append((s_old, new_only[best_j]))
-            used_new_idx.add(best_j)
+            used_new[best_j] = 1
+            paired_old[i] = 1
 
-    paired_old = {w for w, _ in matched_pairs}
-    paired_new = {n for _, n in matched_pairs}
-    old_only_final = [s for s in old_only if s not in paired_old]
-    new_only_final = [s for s in new_only if s not in paired_new]
+    old_only_final = [s for i, s in enumerate(old_only) if not paired_old[i]]
+    new_only_final = [s for j, s in enumerate(new_only) if not used_new[j]]
 
     return matched_pairs, old_only_final, new_only_final
 
+def _item_ts(item: Dict[str, Any]) -> str:
+    return item.get("ts", "")
+
+def _item_key(tag: Optional[str], url: Optional[str], region: Optional[str]) -> str:
+    """Ключ записи кэша (tag, url, region) одной строкой."""
+    return f"{tag}\x00{url}\x00{region}"
+
+def _pair_texts(old_txt: str, new_txt: str):
+    """Разбивка двух текстов на предложения и их попарное сопоставление."""
+    return _pair_changed_sentences(_split_sentences(old_txt), _split_sentences(new_txt), threshold=0.0)
+
+def _pair_texts_batch(texts: List[Tuple[str, str]]) -> list:
+    return [_pair_texts(old_txt, new_txt) for old_txt, new_txt in texts]
+
 def _clip_line(s: str, limit: int = 800) -> str:
     s = (s or "").strip()
     if len(s) <= limit:
@@ -280,14 +564,482 @@ def _clip_line(s: str, limit: int = 800) -> str:
 async def _summarize_async(plain: str) -> str:
     global _last_llm_ts
     async with _llm_sem:
-        async with _llm_lock:
-            now = time.monotonic()
-            wait = LLM_MIN_INTERVAL - (now - _last_llm_ts)
-            if wait > 0:
-                await asyncio.sleep(wait)
-            _last_llm_ts = time.monotonic()
+        # Резервируем слот старта без lock: между чтением и записью _last_llm_ts нет await,
+        # поэтому в однопоточном event loop это атомарно. Интервал между стартами прежний.
+        now = time.monotonic()
+        start = max(now, _last_llm_ts + LLM_MIN_INTERVAL)
+        _last_llm_ts = start
+        if start > now:
+            await asyncio.sleep(start - now)
         return await asyncio.to_thread(summarize_rules, plain)
 
+async def _fetch_source(url: str, region: str, custom_lang: Optional[str],
+                        proxy_country: Optional[str], session_id: Optional[str],
+                        validators: Optional[Dict[str, str]] = None,
+                        rng: Optional[random.Random] = None
+                        ) -> Tuple[Optional[str], Optional[str], Dict[str, Any]]:
+    """
+    Загрузка страницы с ретраями и фолбэками прокси. Возвращает (html, error, meta).
+    validators — etag/last_modified прошлого ответа для условного GET;
+    meta: {"not_modified": True} на 304, иначе etag/last_modified текущего ответа.
+    """
+    # Получаем прокси для региона источника
+    proxies = _get_proxy_for_region(region, proxy_country, session_id)
+    
+    # Отладочное логирование прокси
+    if proxies:
+        proxy_url = proxies.get('https://') or proxies.get('http://', '')
+        # Показываем только proxy.froxy.com:9000 для безопасности
+        safe_proxy = proxy_url.split('@')[-1] if '@' in proxy_url else proxy_url
+        log.info(f"🔐 Используется прокси для {region}: {safe_proxy}")
+    else:
+        log.warning(f"⚠️ Прокси НЕ ИСПОЛЬЗУЕТСЯ для {region} (proxies=None)")
+    
+    # Accept-Language по региону или кастомный
+    accept_lang = custom_lang or _DEFAULT_LANG_BY_REGION.get(region, "en-US,en;q=0.9")
+    # Условный GET: если страница не менялась, сервер ответит 304 без тела
+    cond_headers: Dict[str, str] = {}
+    if validators:
+        if validators.get("etag"):
+            cond_headers["If-None-Match"] = validators["etag"]
+        if validators.get("last_modified"):
+            cond_headers["If-Modified-Since"] = validators["last_modified"]
+    rng = rng or random
+    headers = {**_get_random_headers(url, accept_lang, rng), **cond_headers}
+    
+    # SSL проверка: отключаем для Bright Data
+    verify_ssl = False if PROXY_PROVIDER == "brightdata" else (proxies is None)
+    
+    html = None
+    used_fallback = False
+    meta: Dict[str, Any] = {}
+    
+    # Используем curl-cffi для ВСЕХ запросов через прокси
+    # ОТКЛЮЧЕНО на Railway - curl-cffi не работает с прокси там
+    # use_curl_cffi = CURL_CFFI_AVAILABLE and USE_PROXY
+    use_curl_cffi = False
+    
+    try:
+        # Retry логика
+        err = None
+        for attempt in range(FETCH_RETRIES):
+            try:
+                log.info(f"🔍 HTTP запрос attempt {attempt+1}/{FETCH_RETRIES} к {url} ({'curl-cffi' if use_curl_cffi else 'httpx'})")
+                
+                if use_curl_cffi:
+                    timeout_seconds = TIMEOUT.total if hasattr(TIMEOUT, 'total') else 30.0
+                    r = await _fetch_with_curl_cffi(url, headers, proxies, timeout_seconds)
+                    block_scanned = False
+                else:
+                    async with _http_client(proxies, verify_ssl, url) as client:
+                        r, block_scanned = await _get_streamed(client, url, headers)
+                
+                log.info(f"🔍 HTTP ответ: статус {r.status_code}, HTML: {len(r.text)} симв")
+                
+                # Особая обработка для статусов 400/422 - Meta сайты часто возвращают эти коды с валидным HTML
+                log.debug(f"🔍 DEBUG: Получили статус {r.status_code} для {url}")
+                if r.status_code == 304:
+                    log.info(f"♻️ 304 Not Modified: {url}")
+                    return None, None, {"not_modified": True}
+                if r.status_code in [400, 422]:
+                    # Для Meta/Facebook сайтов принимаем любой ответ с содержимым
+                    is_meta_site = _is_meta_site(url)
+                    log.info(f"🔍 {r.status_code} DEBUG: is_meta_site={is_meta_site}, HTML size={len(r.text) if r.text else 0}")
+                    if is_meta_site and r.text and len(r.text.strip()) > 100:
+                        log.info(f"✅ Meta сайт: Статус {r.status_code} но получен HTML ({len(r.text)} симв.), продолжаем")
+                        html = r.text
+                    elif r.text and len(r.text.strip()) > 500:
+                        log.info(f"✅ Статус {r.status_code} но получен валидный HTML ({len(r.text)} симв.), продолжаем")
+                        html = r.text
+                    else:
+                        log.warning(f"⚠️ Статус {r.status_code} с коротким ответом ({len(r.text) if r.text else 0} симв.), попробуем еще раз")
+                        # НЕ вызываем raise_for_status для 400/422 - пусть retry цикл обработает
+                        continue  # Пропускаем этот attempt и пробуем следующий
+                elif r.status_code in [200, 201, 202]:
+                    html = r.text
+                else:
+                    r.raise_for_status()
+                    html = r.text
+                
+                # Проверка на блокировку (один проход по байтам ответа; 2xx уже проверены при загрузке)
+                if not block_scanned and _BLOCK_RE.search(r.content):
+                    if hasattr(r, 'request'):
+                        raise httpx.HTTPStatusError("Temporary block", request=r.request, response=r)
+                    else:
+                        raise Exception("Temporary block detected")
+                
+                # Проверка на JavaScript редирект
+                if 'http-equiv="refresh"' in html and '_fb_noscript=1' in html:
+                    # Получили страницу с редиректом, но уже с _fb_noscript - это ошибка
+                    if hasattr(r, 'request'):
+                        raise httpx.HTTPStatusError("JS redirect page despite _fb_noscript=1", request=r.request, response=r)
+                    else:
+                        raise Exception("JS redirect page despite _fb_noscript=1")
+                
+                elif 'http-equiv="refresh"' in html and 'URL=' in html:
+                    # Обнаружен JavaScript редирект, попробуем с _fb_noscript=1
+                    import re
+                    redirect_match = re.search(r'URL=([^"]+)', html)
+                    if redirect_match:
+                        redirect_url = redirect_match.group(1)
+                        if not redirect_url.startswith('http'):
+                            # Относительный URL
+                            from urllib.parse import urljoin
+                            redirect_url = urljoin(url, redirect_url)
+                        
+                        log.info(f"🔄 JS редирект обнаружен, переходим на: {redirect_url}")
+                        
+                        if use_curl_cffi:
+                            timeout_seconds = TIMEOUT.total if hasattr(TIMEOUT, 'total') else 30.0
+                            r = await _fetch_with_curl_cffi(redirect_url, headers, proxies, timeout_seconds)
+                        else:
+                            # Для httpx — отдельный клиент (без куки первого ответа) поверх общего пула
+                            async with _http_client(proxies, verify_ssl, redirect_url) as client:
+                                r = await client.get(redirect_url, headers=headers)
+                            r.raise_for_status()
+                        html = r.text
+                
+                resp_headers = getattr(r, "headers", None) or {}
+                meta = {"etag": resp_headers.get("etag"), "last_modified": resp_headers.get("last-modified")}
+                break  # Успешно!
+            except (httpx.HTTPStatusError, httpx.ProxyError, Exception) as e:
+                # Обработка ошибок для обоих httpx и curl-cffi
+                if isinstance(e, httpx.ProxyError):
+                    # Пытаемся извлечь статус из сообщения
+                    error_msg = str(e)
+                    if '400' in error_msg:
+                        status = 400
+                    elif '422' in error_msg:
+                        status = 422
+                    elif '500' in error_msg:
+                        status = 500
+                    else:
+                        status = 0
+                    response_text = ''
+                    log.info(f"🔍 ProxyError: сообщение='{error_msg}', извлечен статус={status}")
+                elif isinstance(e, httpx.HTTPStatusError):
+                    status = getattr(e.response, 'status_code', 0) if hasattr(e, 'response') else 0
+                    response_text = getattr(e.response, 'text', '') if hasattr(e, 'response') and e.response else ''
+                    log.info(f"🔍 {type(e).__name__} пойман: статус {status}, HTML: {len(response_text)} симв")
+                else:
+                    # Ошибки curl-cffi или другие
+                    status = 0
+                    response_text = ''
+                    log.info(f"🔍 {type(e).__name__}: {str(e)}")
+                
+                # curl-cffi должен решить проблему TLS fingerprinting
+                if use_curl_cffi:
+                    log.warning(f"⚠️ Ошибка с curl-cffi: {e}")
+                
+                # ProxyError 500 - прокси не может достучаться до Meta, пробуем без прокси
+                if isinstance(e, httpx.ProxyError) and status == 500 and attempt == 0:
+                    log.warning(f"⚠️ ProxyError 500 - прокси заблокирован Meta. Пробуем прямое подключение...")
+                    proxies = None  # Отключаем прокси
+                    verify_ssl = True  # Включаем SSL проверку
+                    used_fallback = True
+                    await asyncio.sleep(2)
+                    continue
+                
+                # 407/403 для MD -> пробуем fallback на EU
+                if status in (407, 403) and region == "MD" and PROXY_FALLBACK_EU and PROXY_URL_EU and attempt == 0:
+                    log.warning(f"⚠️ Ошибка {status} для MD прокси, переключаемся на EU fallback...")
+                    # Переключаемся на EU прокси
+                    proxies = _get_proxy_for_region("EU", proxy_country, session_id)
+                    used_fallback = True
+                    await asyncio.sleep(2)  # Быстрое переключение на EU
+                    continue
+                
+                if status in (500, 502, 503, 429, 403, 407):
+                    err = e
+                    if attempt < FETCH_RETRIES - 1:
+                        backoff = FETCH_RETRY_BACKOFF * (1.5 ** attempt) + rng.random() * 2  # Быстрые retry
+                        if status == 500:
+                            log.warning(f"⚠️ Сервер Meta недоступен (500), попытка {attempt+1}/{FETCH_RETRIES}, ожидание {backoff:.1f} сек...")
+                        else:
+                            log.warning(f"⚠️ Ошибка {status} при загрузке {url}, попытка {attempt+1}/{FETCH_RETRIES}, ожидание {backoff:.1f} сек...")
+                        await asyncio.sleep(backoff)
+                        headers = {**_get_random_headers(url, accept_lang, rng), **cond_headers}
+                    else:
+                        if status == 429:
+                            log.error(f"❌ Facebook заблокировал запросы: {url}. Пропускаем.")
+                            err = None
+                            break
+                        raise
+                else:
+                    raise
+            else:
+                # Проверяем если HTML получен через fallback - не выбрасываем ошибку
+                if html:
+                    log.info(f"✅ HTML получен через fallback, продолжаем обработку")
+                    err = None  # Сбрасываем ошибку
+                elif err:
+                    raise err
+    except Exception as e:
+        log.info(f"🔍 Внешний Exception пойман: {type(e).__name__}: {e}, HTML: {len(html) if html else 0} симв")
+        # Проверяем, что не получили ли HTML во время 422 ошибки
+        if html:
+            log.info(f"✅ HTML получен несмотря на ошибку ({len(html)} симв.), продолжаем обработку")
+        else:
+            log.error("Ошибка при загрузке %s: %s", url, e)
+            return None, str(e), {}
+    
+    if not html:
+        return None, "No HTML received", {}
+    
+    if used_fallback:
+        log.info(f"✅ Успешно получено через EU fallback: {url}")
+    return html, None, meta
+
+# Версия разбора страницы: увеличить при изменении очистки/нормализации/выделения секций —
+# сохранённые raw_sig перестанут совпадать, и страницы будут разобраны заново
+_PARSE_VERSION = "1"
+
+@lru_cache(maxsize=None)
+def _parse_sig(url: str) -> str:
+    """Подпись настроек разбора для URL: версия разбора + ignore_selectors его хоста."""
+    return compute_hash(_PARSE_VERSION + "\n" + "\n".join(selectors_for(url)))
+
+def _remember_fetch(item: Dict[str, Any], raw_sig: str, meta: Dict[str, Any]) -> None:
+    """Сохраняет в запись кэша подпись сырого HTML и валидаторы ответа (ETag/Last-Modified)."""
+    item["raw_sig"] = raw_sig
+    for k in ("etag", "last_modified"):
+        if meta.get(k):
+            item[k] = meta[k]
+        else:
+            item.pop(k, None)
+
+async def _process_page(run: Dict[str, Any], src_idx: int, tag: str, url: str, region: str,
+                        title_hint: Optional[str], html: str, meta: Optional[Dict[str, Any]] = None) -> None:
+    """Разбор страницы, дифф с кэшем, суммаризация; результат пишется в состояние прогона."""
+    cache: List[Dict[str, Any]] = run["cache"]
+    idx: Dict[str, int] = run["idx"]
+    meta = meta or {}
+
+    key = _item_key(tag, url, region)
+    existing_i = idx.get(key)
+    existing = cache[existing_i] if existing_i is not None else None
+
+    # тот же сырой HTML при тех же настройках разбора, что и в прошлый раз — результат заведомо тот же
+    raw_sig = compute_hash(_parse_sig(url) + compute_hash(html))
+    if existing is not None and existing.get("raw_sig") == raw_sig:
+        _remember_fetch(existing, raw_sig, meta)
+        return
+
+    title_auto, full_plain, soup = clean_html_soup(html, url)
+
+    plain_norm = normalize_plain(full_plain or "")
+    page_sig = compute_hash(plain_norm)
+
+    # секции берём из уже очищенного дерева; повторный парсинг — только если
+    # отладочный HTML обрезается по лимиту (сохраняем прежний набор секций)
+    cleaned_html = str(soup)
+    if not cleaned_html:
+        sections_new = extract_sections(html)
+    elif len(cleaned_html) > CLEANED_HTML_LIMIT:
+        sections_new = extract_sections(cleaned_html[:CLEANED_HTML_LIMIT])
+    else:
+        sections_new = extract_sections(soup)
+    sec_map_new = {s["id"]: s for s in sections_new if s.get("id")}
+
+    added_ids, removed_ids, modified_ids = [], [], []
+    # sec_first_old — первая секция с данным id (для заголовков/текста в диффе)
+    sec_map_old: Dict[str, Dict[str, Any]] = {}
+    sec_first_old: Dict[str, Dict[str, Any]] = {}
+
+    if existing:
+        for s in existing.get("sections") or []:
+            sid = s.get("id")
+            if sid:
+                sec_map_old[sid] = s
+                sec_first_old.setdefault(sid, s)
+        # один проход по новым секциям: added/modified, затем по старым: removed
+        for sid, s in sec_map_new.items():
+            old_s = sec_map_old.get(sid)
+            if old_s is None:
+                added_ids.append(sid)
+            elif s.get("sig") != old_s.get("sig"):
+                modified_ids.append(sid)
+        removed_ids = [sid for sid in sec_map_old if sid not in sec_map_new]
+    else:
+        added_ids = list(sec_map_new.keys())
+
+    changed_here = bool(
+        added_ids or removed_ids or modified_ids or
+        (existing is None) or
+        (existing and existing.get("hash") != page_sig)
+    )
+    if not changed_here:
+        _remember_fetch(existing, raw_sig, meta)
+        return
+    
+    summary = _trans_get(page_sig)
+    if summary is None:
+        summary = await _summarize_async(full_plain or "")
+        _trans_put(page_sig, summary)
+    
+    title = (title_hint or title_auto or "").strip() or url
+    
+    old_full = (existing or {}).get("full_text") or ""
+    new_full = full_plain or ""
+    if old_full == new_full:
+        # текст страницы не менялся (изменились только секции) — глобальный дифф пуст
+        pairs_global, old_only_global, new_only_global = [], [], []
+    else:
+        # попарное сравнение предложений — CPU-bound, уводим с event loop
+        pairs_global, old_only_global, new_only_global = await asyncio.to_thread(
+            _pair_texts, old_full, new_full
+        )
+
+    global_diff = {
+        "changed": [{"was": _clip_line(w), "now": _clip_line(n)} for (w, n) in pairs_global],
+        "removed": [_clip_line(s) for s in old_only_global],
+        "added": [_clip_line(s) for s in new_only_global],
+    }
+
+    # заголовки секций нужны и в section_diffs, и в details — считаем один раз
+    new_titles = {sid: sec_map_new[sid].get("title") or sid for sid in added_ids + modified_ids}
+    old_titles = {sid: sec_first_old[sid].get("title") or sid for sid in removed_ids}
+
+    section_diffs: List[Dict[str, Any]] = []
+    if added_ids:
+        added_preview = []
+        for sid in added_ids:
+            sents = _split_sentences(sec_map_new[sid].get("text") or "")
+            added_preview.append(_clip_line(sents[0] if sents else new_titles[sid]))
+        section_diffs.append({"type": "added", "title": "Добавлено", "added": added_preview})
+
+    if removed_ids:
+        removed_titles = [_clip_line(old_titles[sid]) for sid in removed_ids]
+        section_diffs.append({"type": "removed", "title": "Удалено", "removed": removed_titles})
+
+    if modified_ids:
+        texts = []
+        for sid in modified_ids:
+            old_s = sec_first_old.get(sid, {})
+            texts.append((old_s.get("text") or "", sec_map_new[sid].get("text") or ""))
+        # все изменённые секции — одним заходом в поток
+        section_pairs = await asyncio.to_thread(_pair_texts_batch, texts)
+        for sid, (pairs_s, old_only_s, new_only_s) in zip(modified_ids, section_pairs):
+            block = {
+                "type": "changed",
+                "title": new_titles[sid],
+                "changed": [{"was": _clip_line(w), "now": _clip_line(n)} for (w, n) in pairs_s]
+            }
+            if old_only_s:
+                block["removed_inline"] = [_clip_line(s) for s in old_only_s]
+            if new_only_s:
+                block["added_inline"] = [_clip_line(s) for s in new_only_s]
+            section_diffs.append(block)
+
+    item = {
+        "tag": tag,
+        "url": url,
+        "region": region,  # ✨ добавлен region
+        "title": title,
+        "summary": (summary or "").strip(),
+        "ts": run["ts"],
+        "hash": page_sig,
+        "sections": sections_new,
+        "full_text": new_full,
+        "last_changed_at": run["ts"],
+    }
+    _remember_fetch(item, raw_sig, meta)
+
+    if existing_i is not None:
+        cache[existing_i] = item
+    else:
+        cache.append(item)
+        idx[key] = len(cache) - 1
+    
+    run["changed_pages"] += 1
+    run["changed_sections_total"] += len(added_ids) + len(modified_ids) + len(removed_ids)
+    
+    run["details"][src_idx] = {
+        "tag": tag,
+        "url": url,
+        "region": region,  # ✨ добавлен region
+        "title": title,
+        "diff": {
+            "added": [new_titles[sid] for sid in added_ids],
+            "modified": [new_titles[sid] for sid in modified_ids],
+            "removed": [old_titles[sid] for sid in removed_ids],
+        },
+        "global_diff": global_diff,
+        "section_diffs": section_diffs
+    }
+
+async def _produce_host(jobs: List[Tuple[int, Dict[str, Any], str]], queue: asyncio.Queue,
+                        run: Dict[str, Any], errors: List[Dict[str, Any]], session_id: Optional[str],
+                        fetch_sem: asyncio.Semaphore) -> None:
+    """Источники одного хоста — строго по очереди и с паузами между запросами."""
+    rng: random.Random = run["rng"]
+    for n, (src_idx, src, url) in enumerate(jobs):
+        tag, title_hint = src.get("tag"), src.get("title")
+        region = src.get("region", "GLOBAL")
+        custom_lang = src.get("lang")  # опциональный параметр
+        proxy_country = src.get("proxy_country")  # опциональный параметр
+        
+        # Минимальные задержки для резидентных прокси - максимальная эффективность
+        if n > 0:
+            if "whatsapp.com" in url:
+                delay = 2.0 + rng.random() * 1.0  # 2-3 сек для WhatsApp
+                log.info(f"💬 ⏳ WhatsApp: {delay:.1f} сек")
+            else:
+                # Минимальные интервалы с прокси - как на локалке
+                delay = 0.5 + rng.random() * 1.0  # 0.5-1.5 сек для Meta
+                log.info(f"⏳ {delay:.1f} сек")
+            await asyncio.sleep(delay)
+        
+        existing_i = run["idx"].get(_item_key(tag, url, region))
+        validators = run["cache"][existing_i] if existing_i is not None else None
+        
+        async with fetch_sem:
+            html, err, meta = await _fetch_source(url, region, custom_lang, proxy_country, session_id, validators, rng)
+        if err:
+            errors.append({"tag": tag, "url": url, "region": region, "error": err})
+            continue
+        if meta.get("not_modified"):
+            continue
+        # очередь ограничена — загрузка не убегает далеко вперёд от суммаризации
+        await queue.put((src_idx, tag, url, region, title_hint, html, meta))
+
+async def _produce_pages(queue: asyncio.Queue, run: Dict[str, Any], errors: List[Dict[str, Any]],
+                         session_id: Optional[str], n_workers: int) -> None:
+    """Стадия загрузки: хосты качаются параллельно, паузы выдерживаются только внутри хоста."""
+    try:
+        by_host: Dict[str, List[Tuple[int, Dict[str, Any], str]]] = {}
+        for src_idx, src in enumerate(SOURCES):
+            if not src.get("tag") or not src.get("url"):
+                continue
+            # Обрабатываем Facebook URL для обхода JavaScript редиректов
+            url = _fix_facebook_url(src.get("url"))
+            by_host.setdefault(urlparse(url).netloc.lower(), []).append((src_idx, src, url))
+        
+        fetch_sem = asyncio.Semaphore(FETCH_CONCURRENCY)
+        results = await asyncio.gather(
+            *(_produce_host(jobs, queue, run, errors, session_id, fetch_sem) for jobs in by_host.values()),
+            return_exceptions=True,
+        )
+        for host, res in zip(by_host, results):
+            if isinstance(res, Exception):
+                log.error("Ошибка загрузки источников %s: %s", host, res)
+    finally:
+        for _ in range(n_workers):
+            await queue.put(None)
+
+async def _consume_pages(queue: asyncio.Queue, run: Dict[str, Any], errors: List[Dict[str, Any]]) -> None:
+    """Стадия обработки: разбор, дифф и суммаризация страниц из очереди."""
+    while True:
+        job = await queue.get()
+        if job is None:
+            return
+        src_idx, tag, url, region, title_hint, html, meta = job
+        try:
+            await _process_page(run, src_idx, tag, url, region, title_hint, html, meta)
+        except Exception as e:
+            log.error("Ошибка обработки %s: %s", url, e, exc_info=True)
+            errors.append({"tag": tag, "url": url, "region": region, "error": str(e)})
+
 async def run_update() -> dict:
     log.info("🔄 Pipeline запущен - версия 2025-10-19-v4 с минимальными интервалами")
     
@@ -326,372 +1078,42 @@ async def run_update() -> dict:
     except Exception as e:
         log.warning(f"⚠️ Ошибка проверки IP: {e}")
     errors: List[Dict[str, Any]] = []
-    details: List[Dict[str, Any]] = []
 
     cache_data = load_cache() or {}
     cache: List[Dict[str, Any]] = cache_data.get("items", [])
     # Ключ теперь (tag, url, region)
-    idx: Dict[Tuple[str, str, str], int] = {
-        (it.get("tag"), it.get("url"), it.get("region", "GLOBAL")): i 
+    idx: Dict[str, int] = {
+        _item_key(it.get("tag"), it.get("url"), it.get("region", "GLOBAL")): i
         for i, it in enumerate(cache) if isinstance(it, dict)
     }
 
-    changed_pages = 0
-    changed_sections_total = 0
+    # Один ГСЧ на прогон (UA, паузы, backoff); PIPELINE_SEED — для воспроизводимых прогонов
+    seed = os.getenv("PIPELINE_SEED")
+    rng = random.Random(int(seed) if seed else None)
 
     # Генерируем session ID для sticky-сессий
-    session_id = f"rand{random.randint(10000, 99999)}" if PROXY_STICKY else None
+    session_id = f"rand{rng.randint(10000, 99999)}" if PROXY_STICKY else None
     
-    # Для каждого источника будем создавать свой клиент с подходящим прокси
-    for src_idx, src in enumerate(SOURCES):
-        tag, url, title_hint = src.get("tag"), src.get("url"), src.get("title")
-        region = src.get("region", "GLOBAL")
-        custom_lang = src.get("lang")  # опциональный параметр
-        proxy_country = src.get("proxy_country")  # опциональный параметр
-        
-        if not tag or not url:
-            continue
-        
-        # Обрабатываем Facebook URL для обхода JavaScript редиректов
-        url = _fix_facebook_url(url)
-        
-        # Минимальные задержки для резидентных прокси - максимальная эффективность
-        if src_idx > 0:
-            if "whatsapp.com" in url:
-                delay = 2.0 + random.random() * 1.0  # 2-3 сек для WhatsApp
-                log.info(f"💬 ⏳ WhatsApp: {delay:.1f} сек")
-            else:
-                # Минимальные интервалы с прокси - как на локалке
-                delay = 0.5 + random.random() * 1.0  # 0.5-1.5 сек для Meta
-                log.info(f"⏳ {delay:.1f} сек")
-            await asyncio.sleep(delay)
-        
-        # Получаем прокси для региона источника
-        proxies = _get_proxy_for_region(region, proxy_country, session_id)
-        
-        # Отладочное логирование прокси
-        if proxies:
-            proxy_url = proxies.get('https://') or proxies.get('http://', '')
-            # Показываем только proxy.froxy.com:9000 для безопасности
-            safe_proxy = proxy_url.split('@')[-1] if '@' in proxy_url else proxy_url
-            log.info(f"🔐 Используется прокси для {region}: {safe_proxy}")
-        else:
-            log.warning(f"⚠️ Прокси НЕ ИСПОЛЬЗУЕТСЯ для {region} (proxies=None)")
-        
-        # Accept-Language по региону или кастомный
-        accept_lang = custom_lang or _DEFAULT_LANG_BY_REGION.get(region, "en-US,en;q=0.9")
-        headers = _get_random_headers(url, accept_lang)
-        
-        # SSL проверка: отключаем для Bright Data
-        verify_ssl = False if PROXY_PROVIDER == "brightdata" else (proxies is None)
-        
-        html = None
-        used_fallback = False
-        
-        # Используем curl-cffi для ВСЕХ запросов через прокси
-        # ОТКЛЮЧЕНО на Railway - curl-cffi не работает с прокси там
-        # use_curl_cffi = CURL_CFFI_AVAILABLE and USE_PROXY
-        use_curl_cffi = False
-        
-        try:
-            # Retry логика
-            err = None
-            for attempt in range(FETCH_RETRIES):
-                try:
-                    log.info(f"🔍 HTTP запрос attempt {attempt+1}/{FETCH_RETRIES} к {url} ({'curl-cffi' if use_curl_cffi else 'httpx'})")
-                    
-                    if use_curl_cffi:
-                        timeout_seconds = TIMEOUT.total if hasattr(TIMEOUT, 'total') else 30.0
-                        r = await _fetch_with_curl_cffi(url, headers, proxies, timeout_seconds)
-                    else:
-                        async with httpx.AsyncClient(timeout=TIMEOUT, follow_redirects=True, proxies=proxies, verify=verify_ssl) as client:
-                            r = await client.get(url, headers=headers)
-                    
-                    log.info(f"🔍 HTTP ответ: статус {r.status_code}, HTML: {len(r.text)} симв")
-                    
-                    # Особая обработка для статусов 400/422 - Meta сайты часто возвращают эти коды с валидным HTML
-                    log.debug(f"🔍 DEBUG: Получили статус {r.status_code} для {url}")
-                    if r.status_code in [400, 422]:
-                        # Для Meta/Facebook сайтов принимаем любой ответ с содержимым
-                        is_meta_site = any(domain in url for domain in ["transparency.meta.com", "facebook.com", "about.fb.com", "developers.facebook.com"])
-                        log.info(f"🔍 {r.status_code} DEBUG: is_meta_site={is_meta_site}, HTML size={len(r.text) if r.text else 0}")
-                        if is_meta_site and r.text and len(r.text.strip()) > 100:
-                            log.info(f"✅ Meta сайт: Статус {r.status_code} но получен HTML ({len(r.text)} симв.), продолжаем")
-                            html = r.text
-                        elif r.text and len(r.text.strip()) > 500:
-                            log.info(f"✅ Статус {r.status_code} но получен валидный HTML ({len(r.text)} симв.), продолжаем")
-                            html = r.text
-                        else:
-                            log.warning(f"⚠️ Статус {r.status_code} с коротким ответом ({len(r.text) if r.text else 0} симв.), попробуем еще раз")
-                            # НЕ вызываем raise_for_status для 400/422 - пусть retry цикл обработает
-                            continue  # Пропускаем этот attempt и пробуем следующий
-                    elif r.status_code in [200, 201, 202]:
-                        html = r.text
-                    else:
-                        r.raise_for_status()
-                        html = r.text
-                    
-                    # Проверка на блокировку
-                    if "You're Temporarily Blocked" in html or "going too fast" in html:
-                        if hasattr(r, 'request'):
-                            raise httpx.HTTPStatusError("Temporary block", request=r.request, response=r)
-                        else:
-                            raise Exception("Temporary block detected")
-                    
-                    # Проверка на JavaScript редирект
-                    if 'http-equiv="refresh"' in html and '_fb_noscript=1' in html:
-                        # Получили страницу с редиректом, но уже с _fb_noscript - это ошибка
-                        if hasattr(r, 'request'):
-                            raise httpx.HTTPStatusError("JS redirect page despite _fb_noscript=1", request=r.request, response=r)
-                        else:
-                            raise Exception("JS redirect page despite _fb_noscript=1")
-                    
-                    elif 'http-equiv="refresh"' in html and 'URL=' in html:
-                        # Обнаружен JavaScript редирект, попробуем с _fb_noscript=1
-                        import re
-                        redirect_match = re.search(r'URL=([^"]+)', html)
-                        if redirect_match:
-                            redirect_url = redirect_match.group(1)
-                            if not redirect_url.startswith('http'):
-                                # Относительный URL
-                                from urllib.parse import urljoin
-                                redirect_url = urljoin(url, redirect_url)
-                            
-                            log.info(f"🔄 JS редирект обнаружен, переходим на: {redirect_url}")
-                            
-                            if use_curl_cffi:
-                                timeout_seconds = TIMEOUT.total if hasattr(TIMEOUT, 'total') else 30.0
-                                r = await _fetch_with_curl_cffi(redirect_url, headers, proxies, timeout_seconds)
-                            else:
-                                # Для httpx создаем новый клиент
-                                async with httpx.AsyncClient(timeout=TIMEOUT, follow_redirects=True, proxies=proxies, verify=verify_ssl) as redirect_client:
-                                    r = await redirect_client.get(redirect_url, headers=headers)
-                                    r.raise_for_status()
-                            html = r.text
-                    
-                    break  # Успешно!
-                except (httpx.HTTPStatusError, httpx.ProxyError, Exception) as e:
-                    # Обработка ошибок для обоих httpx и curl-cffi
-                    if isinstance(e, httpx.ProxyError):
-                        # Пытаемся извлечь статус из сообщения
-                        error_msg = str(e)
-                        if '400' in error_msg:
-                            status = 400
-                        elif '422' in error_msg:
-                            status = 422
-                        elif '500' in error_msg:
-                            status = 500
-                        else:
-                            status = 0
-                        response_text = ''
-                        log.info(f"🔍 ProxyError: сообщение='{error_msg}', извлечен статус={status}")
-                    elif isinstance(e, httpx.HTTPStatusError):
-                        status = getattr(e.response, 'status_code', 0) if hasattr(e, 'response') else 0
-                        response_text = getattr(e.response, 'text', '') if hasattr(e, 'response') and e.response else ''
-                        log.info(f"🔍 {type(e).__name__} пойман: статус {status}, HTML: {len(response_text)} симв")
-                    else:
-                        # Ошибки curl-cffi или другие
-                        status = 0
-                        response_text = ''
-                        log.info(f"🔍 {type(e).__name__}: {str(e)}")
-                    
-                    # curl-cffi должен решить проблему TLS fingerprinting
-                    if use_curl_cffi:
-                        log.warning(f"⚠️ Ошибка с curl-cffi: {e}")
-                    
-                    # ProxyError 500 - прокси не может достучаться до Meta, пробуем без прокси
-                    if isinstance(e, httpx.ProxyError) and status == 500 and attempt == 0:
-                        log.warning(f"⚠️ ProxyError 500 - прокси заблокирован Meta. Пробуем прямое подключение...")
-                        proxies = None  # Отключаем прокси
-                        verify_ssl = True  # Включаем SSL проверку
-                        used_fallback = True
-                        await asyncio.sleep(2)
-                        continue
-                    
-                    # 407/403 для MD -> пробуем fallback на EU
-                    if status in (407, 403) and region == "MD" and PROXY_FALLBACK_EU and PROXY_URL_EU and attempt == 0:
-                        log.warning(f"⚠️ Ошибка {status} для MD прокси, переключаемся на EU fallback...")
-                        # Переключаемся на EU прокси
-                        proxies = _get_proxy_for_region("EU", proxy_country, session_id)
-                        used_fallback = True
-                        await asyncio.sleep(2)  # Быстрое переключение на EU
-                        continue
-                    
-                    if status in (500, 502, 503, 429, 403, 407):
-                        err = e
-                        if attempt < FETCH_RETRIES - 1:
-                            backoff = FETCH_RETRY_BACKOFF * (1.5 ** attempt) + random.random() * 2  # Быстрые retry
-                            if status == 500:
-                                log.warning(f"⚠️ Сервер Meta недоступен (500), попытка {attempt+1}/{FETCH_RETRIES}, ожидание {backoff:.1f} сек...")
-                            else:
-                                log.warning(f"⚠️ Ошибка {status} при загрузке {url}, попытка {attempt+1}/{FETCH_RETRIES}, ожидание {backoff:.1f} сек...")
-                            await asyncio.sleep(backoff)
-                            headers = _get_random_headers(url, accept_lang)
-                        else:
-                            if status == 429:
-                                log.error(f"❌ Facebook заблокировал запросы: {url}. Пропускаем.")
-                                err = None
-                                break
-                            raise
-                    else:
-                        raise
-                else:
-                    # Проверяем если HTML получен через fallback - не выбрасываем ошибку
-                    if html:
-                        log.info(f"✅ HTML получен через fallback, продолжаем обработку")
-                        err = None  # Сбрасываем ошибку
-                    elif err:
-                        raise err
-        except Exception as e:
-            log.info(f"🔍 Внешний Exception пойман: {type(e).__name__}: {e}, HTML: {len(html) if html else 0} симв")
-            # Проверяем, что не получили ли HTML во время 422 ошибки
-            if html:
-                log.info(f"✅ HTML получен несмотря на ошибку ({len(html)} симв.), продолжаем обработку")
-            else:
-                log.error("Ошибка при загрузке %s: %s", url, e)
-                errors.append({"tag": tag, "url": url, "region": region, "error": str(e)})
-                continue
-        
-        if not html:
-            errors.append({"tag": tag, "url": url, "region": region, "error": "No HTML received"})
-            continue
-        
-        if used_fallback:
-            log.info(f"✅ Успешно получено через EU fallback: {url}")
-        
-        title_auto, full_plain, cleaned_html = clean_html(html, url)
-
-        plain_norm = normalize_plain(full_plain or "")
-        page_sig = compute_hash(plain_norm)
-
-        sections_new = extract_sections(cleaned_html or html)
-        sec_map_new = {s["id"]: s for s in sections_new if s.get("id")}
-
-        key = (tag, url, region)
-        existing_i = idx.get(key)
-        existing = cache[existing_i] if existing_i is not None else None
-
-        added_ids, removed_ids, modified_ids = [], [], []
-
-        if existing:
-            old_sections = existing.get("sections") or []
-            sec_map_old = {s.get("id"): s for s in old_sections if s.get("id")}
-            new_ids = set(sec_map_new.keys())
-            old_ids = set(sec_map_old.keys())
-            added_ids = list(new_ids - old_ids)
-            removed_ids = list(old_ids - new_ids)
-            modified_ids = [sid for sid in (new_ids & old_ids)
-                            if sec_map_new[sid].get("sig") != sec_map_old[sid].get("sig")]
-        else:
-            added_ids = list(sec_map_new.keys())
-
-        changed_here = bool(
-            added_ids or removed_ids or modified_ids or
-            (existing is None) or
-            (existing and existing.get("hash") != page_sig)
-        )
-        if not changed_here:
-            continue
-        
-        if page_sig in trans_cache:
-            summary = trans_cache[page_sig]
-        else:
-            summary = await _summarize_async(full_plain or "")
-            trans_cache[page_sig] = summary
-        
-        title = (title_hint or title_auto or "").strip() or url
-        
-        old_full = (existing or {}).get("full_text") or ""
-        new_full = full_plain or ""
-        old_sents = _split_sentences(old_full)
-        new_sents = _split_sentences(new_full)
-        pairs_global, old_only_global, new_only_global = _pair_changed_sentences(
-            old_sents, new_sents, threshold=0.0
-        )
-
-        global_diff = {
-            "changed": [{"was": _clip_line(w), "now": _clip_line(n)} for (w, n) in pairs_global],
-            "removed": [_clip_line(s) for s in old_only_global],
-            "added": [_clip_line(s) for s in new_only_global],
-        }
+    run: Dict[str, Any] = {
+        "cache": cache,
+        "idx": idx,
+        "details": {},  # src_idx -> detail: порядок как в SOURCES
+        "changed_pages": 0,
+        "changed_sections_total": 0,
+        # одна метка времени на прогон — для ts/last_changed_at всех изменённых записей
+        "ts": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "rng": rng,
+    }
 
-        section_diffs: List[Dict[str, Any]] = []
-        if added_ids:
-            added_preview = []
-            for sid in added_ids:
-                sents = _split_sentences(sec_map_new[sid].get("text") or "")
-                added_preview.append(_clip_line(sents[0] if sents else (sec_map_new[sid].get("title") or sid)))
-            section_diffs.append({"type": "added", "title": "Добавлено", "added": added_preview})
-
-        if removed_ids:
-            removed_titles = []
-            for sid in removed_ids:
-                old_sec = next((s for s in (existing or {}).get("sections", []) if s.get("id") == sid), None)
-                ttl = (old_sec or {}).get("title") or sid
-                removed_titles.append(_clip_line(ttl))
-            section_diffs.append({"type": "removed", "title": "Удалено", "removed": removed_titles})
-
-        if modified_ids:
-            for sid in modified_ids:
-                old_s = next((s for s in (existing or {}).get("sections", []) if s.get("id") == sid), {})
-                new_s = sec_map_new[sid]
-                old_txt = old_s.get("text") or ""
-                new_txt = new_s.get("text") or ""
-                old_sents_s = _split_sentences(old_txt)
-                new_sents_s = _split_sentences(new_txt)
-                pairs_s, old_only_s, new_only_s = _pair_changed_sentences(
-                    old_sents_s, new_sents_s, threshold=0.0
-                )
-                block = {
-                    "type": "changed",
-                    "title": new_s.get("title") or sid,
-                    "changed": [{"was": _clip_line(w), "now": _clip_line(n)} for (w, n) in pairs_s]
-                }
-                if old_only_s:
-                    block["removed_inline"] = [_clip_line(s) for s in old_only_s]
-                if new_only_s:
-                    block["added_inline"] = [_clip_line(s) for s in new_only_s]
-                section_diffs.append(block)
-
-        item = {
-            "tag": tag,
-            "url": url,
-            "region": region,  # ✨ добавлен region
-            "title": title,
-            "summary": (summary or "").strip(),
-            "ts": datetime.now(timezone.utc).isoformat(timespec="seconds"),
-            "hash": page_sig,
-            "sections": sections_new,
-            "full_text": new_full,
-            "last_changed_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
-        }
-
-        if existing_i is not None:
-            cache[existing_i] = item
-        else:
-            cache.append(item)
-            idx[key] = len(cache) - 1
-        
-        changed_pages += 1
-        changed_sections_total += len(added_ids) + len(modified_ids) + len(removed_ids)
-        
-        details.append({
-            "tag": tag,
-            "url": url,
-            "region": region,  # ✨ добавлен region
-            "title": title,
-            "diff": {
-                "added": [sec_map_new[sid].get("title") or sid for sid in added_ids],
-                "modified": [sec_map_new[sid].get("title") or sid for sid in modified_ids],
-                "removed": [
-                    (next((s.get("title") for s in (existing or {}).get("sections", [])
-                           if s.get("id") == sid), sid))
-                    for sid in removed_ids
-                ],
-            },
-            "global_diff": global_diff,
-            "section_diffs": section_diffs
-        })
+    # Конвейер: пока воркеры суммаризируют страницу, загружается следующая
+    queue: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_WORKERS * 2)
+    await asyncio.gather(
+        _produce_pages(queue, run, errors, session_id, PIPELINE_WORKERS),
+        *(_consume_pages(queue, run, errors) for _ in range(PIPELINE_WORKERS)),
+    )
+    details = [run["details"][i] for i in sorted(run["details"])]
+    changed_pages = run["changed_pages"]
+    changed_sections_total = run["changed_sections_total"]
 
     # 🔧 опционально чистим кэш от источников, которых больше нет в config.json
     if PRUNE_REMOVED_SOURCES:
@@ -700,21 +1122,15 @@ async def run_update() -> dict:
         cache = [it for it in cache if (it.get("tag"), it.get("url"), it.get("region", "GLOBAL")) in valid_tuples]
 
     stats = get_cache_stats()
-    cache.sort(key=lambda x: x.get("ts", ""), reverse=True)
     if stats.get("max_cache") and len(cache) > stats["max_cache"]:
-        cache = cache[:stats["max_cache"]]
+        # top-K по ts за O(N log K); результат тот же, что sort(reverse=True) + срез
+        cache = heapq.nlargest(stats["max_cache"], cache, key=_item_ts)
+    else:
+        cache.sort(key=_item_ts, reverse=True)
 
     cache_data["items"] = cache
     save_cache(cache_data)
 
-    try:
-        tmp = TRANS_CACHE_FILE.with_suffix(".tmp")
-        with open(tmp, "w", encoding="utf-8") as tf:
-            json.dump(trans_cache, tf, ensure_ascii=False, indent=2)
-        os.replace(tmp, TRANS_CACHE_FILE)
-    except Exception as e:
-        log.error("Не удалось сохранить кэш переводов: %s", e)
-
     return {
         "changed": changed_pages,
         "errors": errors,
@@ -6,7 +6,8 @@
 
 import logging
 import re
-from typing import Dict, List, Tuple
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 from html import escape
 
 log = logging.getLogger(__name__)
@@ -51,23 +52,89 @@ IMPACT_CATEGORIES = {
     "reporting": ["insight", "metric", "report", "analytics", "attribution", "отчёт", "метрика", "аналитика"],
 }
 
+# Регулярки компилируем один раз на модуль — форматтер вызывается на каждое изменение
+_WS_RE = re.compile(r'\s+')
+_ENDPOINT_RE = re.compile(r'(?:GET|POST|DELETE|PUT)\s+/\{[^}]+\}')
+# Всё, что ищется в нормализованном тексте, — одним проходом.
+# Значение лимита берём через lookahead: «limited to» не съедает следующую за ним дату.
+_KEY_MARKERS_RE = re.compile(
+    r'(?P<date>\b\d{1,2}\s+(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec|янв|фев|мар|апр|май|июн|июл|авг|сен|окт|ноя|дек)[a-zа-я]*\s+\d{4}\b)'
+    r'|(?P<no_longer>no longer available)'
+    r'|(?P<all_versions>applies to all versions)'
+    r'|(?P<limit>limited to)(?:(?= (?P<limit_value>\d+\s+\w+)))?'
+)
+_DATE_STRIP_RE = re.compile(r'\d+\s+\w+\s+\d{4}')
+
+
+def _kw_scan_regex(groups: Dict[str, List[str]]) -> Tuple[re.Pattern, Dict[str, int]]:
+    """
+    Один проход по тексту сразу для всех групп ключевых слов.
+    Нулевая ширина (lookahead) — находим вхождения, начинающиеся в каждой позиции, даже перекрывающиеся;
+    альтернативы идут в порядке групп, так что в одной позиции побеждает более ранняя группа.
+    Возвращает (регулярка, ранг группы по имени).
+    """
+    names = list(groups)
+    alts = "|".join(
+        f"(?P<g{i}>" + "|".join(re.escape(kw) for kw in groups[name]) + ")"
+        for i, name in enumerate(names)
+    )
+    return re.compile(f"(?=(?:{alts}))"), {f"g{i}": i for i in range(len(names))}
+
+
+def _best_group(scan: Tuple[re.Pattern, Dict[str, int]], text: str) -> Optional[int]:
+    """Ранг самой ранней (по порядку словаря) группы, чьё слово встречается в text; None — ни одной."""
+    scan_re, ranks = scan
+    best: Optional[int] = None
+    for m in scan_re.finditer(text):
+        rank = ranks[m.lastgroup]
+        if best is None or rank < best:
+            best = rank
+            if rank == 0:
+                break
+    return best
+
+
+# Порядок словарей = порядок проверки: первая найденная группа побеждает
+_CATEGORY_NAMES = list(IMPACT_CATEGORIES)
+_CATEGORY_SCAN = _kw_scan_regex(IMPACT_CATEGORIES)
+# «информация» на приоритет не влияет — в скан не включаем
+_PRIORITY_LEVELS = [("🔴 КРИТИЧНО", "🔴"), ("🟡 ВАЖНО", "🟡")]
+_PRIORITY_SCAN = _kw_scan_regex({tier: TARGETING_KEYWORDS[tier] for tier in ("критично", "важно")})
+
 
 def _normalize_text(text: str) -> str:
     """Нормализует текст для сравнения"""
-    return re.sub(r'\s+', ' ', (text or "").strip().lower())
+    return _WS_RE.sub(' ', (text or "").strip().lower())
 
 
-def _extract_key_changes(was: str, now: str) -> List[str]:
-    """Извлекает ключевые отличия между двумя текстами"""
-    was_norm = _normalize_text(was)
-    now_norm = _normalize_text(now)
-    
-    # Извлекаем даты
-    date_pattern = r'\b\d{1,2}\s+(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec|янв|фев|мар|апр|май|июн|июл|авг|сен|окт|ноя|дек)[a-zа-я]*\s+\d{4}\b'
-    dates_was = set(re.findall(date_pattern, was_norm))
-    dates_now = set(re.findall(date_pattern, now_norm))
+def _scan_key_markers(text_norm: str) -> Tuple[Set[str], Set[str], str]:
+    """Один проход: (даты, найденные маркеры, первое значение «limited to N ...» или "")."""
+    dates: Set[str] = set()
+    markers: Set[str] = set()
+    limit_value = ""
+    for m in _KEY_MARKERS_RE.finditer(text_norm):
+        if m.group("date"):
+            dates.add(m.group("date"))
+        elif m.group("limit"):
+            markers.add("limit")
+            if not limit_value and m.group("limit_value"):
+                limit_value = m.group("limit_value")
+        else:
+            markers.add(m.lastgroup)
+    return dates, markers, limit_value
+
+
+@lru_cache(maxsize=1024)
+def _extract_key_changes(was: str, now: str) -> Tuple[str, ...]:
+    """
+    Извлекает ключевые отличия между двумя текстами.
+    Мемоизировано: одни и те же пары разбираются и для сводки региона, и для карточки.
+    """
+    dates_was, markers_was, _ = _scan_key_markers(_normalize_text(was))
+    dates_now, markers_now, limit_now = _scan_key_markers(_normalize_text(now))
+    new_markers = markers_now - markers_was
     
-    changes = []
+    changes: List[str] = []
     
     # Изменение дат
     if dates_now - dates_was:
@@ -75,9 +142,8 @@ def _extract_key_changes(was: str, now: str) -> List[str]:
         changes.append(f"Обновлена дата: {new_dates}")
     
     # Новые эндпоинты/поля
-    endpoint_pattern = r'(?:GET|POST|DELETE|PUT)\s+/\{[^}]+\}'
-    endpoints_was = set(re.findall(endpoint_pattern, was))
-    endpoints_now = set(re.findall(endpoint_pattern, now))
+    endpoints_was = set(_ENDPOINT_RE.findall(was))
+    endpoints_now = set(_ENDPOINT_RE.findall(now))
     
     if endpoints_now - endpoints_was:
         for ep in endpoints_now - endpoints_was:
@@ -88,31 +154,24 @@ def _extract_key_changes(was: str, now: str) -> List[str]:
             changes.append(f"Удалён эндпоинт: {ep}")
     
     # Поиск конкретных изменений
-    if "no longer available" in now_norm and "no longer available" not in was_norm:
+    if "no_longer" in new_markers:
         changes.append("⚠️ Функция больше не доступна")
     
-    if "applies to all versions" in now_norm and "applies to all versions" not in was_norm:
+    if "all_versions" in new_markers:
         changes.append("⚠️ Применяется ко ВСЕМ версиям API")
     
     # Ищем новые ограничения
-    if "limited to" in now_norm and "limited to" not in was_norm:
-        limitation = re.search(r'limited to (\d+\s+\w+)', now_norm)
-        if limitation:
-            changes.append(f"⚠️ Новое ограничение: {limitation.group(1)}")
+    if "limit" in new_markers and limit_now:
+        changes.append(f"⚠️ Новое ограничение: {limit_now}")
     
-    return changes
+    return tuple(changes)  # неизменяемый результат — его отдаёт кэш
 
 
-def _detect_impact_category(text: str) -> str:
-    """Определяет категорию влияния изменения"""
-    text_lower = text.lower()
-    
-    for category, keywords in IMPACT_CATEGORIES.items():
-        for kw in keywords:
-            if kw in text_lower:
-                return category
-    
-    return "general"
+@lru_cache(maxsize=1024)
+def _detect_impact_category(text_lower: str) -> str:
+    """Определяет категорию влияния изменения (текст уже в нижнем регистре)"""
+    best = _best_group(_CATEGORY_SCAN, text_lower)
+    return _CATEGORY_NAMES[best] if best is not None else "general"
 
 
 def _assess_priority(was: str, now: str, added: List[str], removed: List[str]) -> Tuple[str, str]:
@@ -120,22 +179,43 @@ def _assess_priority(was: str, now: str, added: List[str], removed: List[str]) -
     Оценивает приоритет изменения
     Возвращает (уровень, иконка)
     """
-    combined_text = f"{was} {now} {' '.join(added)} {' '.join(removed)}".lower()
-    
-    # Критично
-    for kw in TARGETING_KEYWORDS["критично"]:
-        if kw in combined_text:
-            return ("🔴 КРИТИЧНО", "🔴")
-    
-    # Важно
-    for kw in TARGETING_KEYWORDS["важно"]:
-        if kw in combined_text:
-            return ("🟡 ВАЖНО", "🟡")
+    return _priority_of(f"{was} {now} {' '.join(added)} {' '.join(removed)}".lower())
+
+
+@lru_cache(maxsize=1024)
+def _priority_of(combined_lower: str) -> Tuple[str, str]:
+    """То же по готовому тексту в нижнем регистре — чтобы вызывающий мог переиспользовать lower()."""
+    # Критично / Важно — за один проход
+    best = _best_group(_PRIORITY_SCAN, combined_lower)
+    if best is not None:
+        return _PRIORITY_LEVELS[best]
     
     # Информация
     return ("🟢 Инфо", "🟢")
 
 
+def _joined_pairs(changed: List[Dict]) -> Tuple[str, str]:
+    """Склеенные «было» и «стало» всех пар — за один проход по changed."""
+    was_parts: List[str] = []
+    now_parts: List[str] = []
+    for p in changed:
+        was_parts.append(p.get("was", ""))
+        now_parts.append(p.get("now", ""))
+    return " ".join(was_parts), " ".join(now_parts)
+
+
+def _clip_item(item: str) -> str:
+    item_text = item.strip()
+    if len(item_text) > 150:
+        item_text = item_text[:147] + "..."
+    return item_text
+
+
+def _bullets(lines: Iterable[str]) -> str:
+    """Маркированный список одним escape на весь блок (экранирование то же, что построчно)."""
+    return escape("\n".join(f"• {line}" for line in lines))
+
+
 def _format_api_change(detail: Dict) -> str:
     """Специальное форматирование для API изменений"""
     title = detail.get("title", "")
@@ -147,14 +227,15 @@ def _format_api_change(detail: Dict) -> str:
     added = gd.get("added") or []
     removed = gd.get("removed") or []
     
-    output = []
+    output: List[str] = []
+    
+    # Текст пар в нижнем регистре — один раз: и для приоритета, и для категории
+    was_text, now_text = _joined_pairs(changed)
+    was_lower, now_lower = was_text.lower(), now_text.lower()
     
     # Заголовок с приоритетом
-    priority_text, priority_icon = _assess_priority(
-        " ".join([p.get("was", "") for p in changed]),
-        " ".join([p.get("now", "") for p in changed]),
-        added,
-        removed
+    priority_text, priority_icon = _priority_of(
+        f"{was_lower} {now_lower} {' '.join(added).lower()} {' '.join(removed).lower()}"
     )
     
     region_badge = REGION_BADGES.get(region, "🌍 [GLOBAL]")
@@ -163,7 +244,7 @@ def _format_api_change(detail: Dict) -> str:
     output.append("")
     
     # Анализируем изменения
-    key_changes = []
+    key_changes: List[str] = []
     for pair in changed:
         was = pair.get("was", "")
         now = pair.get("now", "")
@@ -172,18 +253,13 @@ def _format_api_change(detail: Dict) -> str:
     
     if key_changes:
         output.append("<b>📝 Что изменилось:</b>")
-        for change in key_changes[:5]:  # Максимум 5 ключевых изменений
-            output.append(f"• {escape(change)}")
+        output.append(_bullets(key_changes[:5]))  # Максимум 5 ключевых изменений
         output.append("")
     
     # Новые возможности
     if added:
         output.append("<b>➕ Добавлено:</b>")
-        for item in added[:3]:  # Топ-3
-            item_text = item.strip()
-            if len(item_text) > 150:
-                item_text = item_text[:147] + "..."
-            output.append(f"• {escape(item_text)}")
+        output.append(_bullets(_clip_item(item) for item in added[:3]))  # Топ-3
         if len(added) > 3:
             output.append(f"<i>... и ещё {len(added) - 3}</i>")
         output.append("")
@@ -191,17 +267,13 @@ def _format_api_change(detail: Dict) -> str:
     # Удалённые элементы
     if removed:
         output.append("<b>➖ Удалено:</b>")
-        for item in removed[:3]:
-            item_text = item.strip()
-            if len(item_text) > 150:
-                item_text = item_text[:147] + "..."
-            output.append(f"• {escape(item_text)}")
+        output.append(_bullets(_clip_item(item) for item in removed[:3]))
         if len(removed) > 3:
             output.append(f"<i>... и ещё {len(removed) - 3}</i>")
         output.append("")
     
     # Рекомендации
-    impact_cat = _detect_impact_category(title + " " + str(changed))
+    impact_cat = _detect_impact_category(f"{title.lower()}\n{was_lower}\n{now_lower}")
     recommendations = _get_recommendations(impact_cat, priority_text, added, removed, changed)
     
     if recommendations:
@@ -226,15 +298,10 @@ def _format_policy_change(detail: Dict) -> str:
     gd = detail.get("global_diff") or {}
     changed = gd.get("changed") or []
     
-    output = []
+    output: List[str] = []
     
     # Определяем приоритет
-    priority_text, priority_icon = _assess_priority(
-        " ".join([p.get("was", "") for p in changed]),
-        " ".join([p.get("now", "") for p in changed]),
-        [],
-        []
-    )
+    priority_text, priority_icon = _assess_priority(*_joined_pairs(changed), [], [])
     
     region_badge = REGION_BADGES.get(region, "🌍 [GLOBAL]")
     output.append(f"{priority_icon} <b>{escape(title)}</b> {region_badge}")
@@ -247,8 +314,8 @@ def _format_policy_change(detail: Dict) -> str:
         now = _normalize_text(pair.get("now", ""))
         
         # Игнорируем изменения только в датах
-        was_no_dates = re.sub(r'\d+\s+\w+\s+\d{4}', '', was)
-        now_no_dates = re.sub(r'\d+\s+\w+\s+\d{4}', '', now)
+        was_no_dates = _DATE_STRIP_RE.sub('', was)
+        now_no_dates = _DATE_STRIP_RE.sub('', now)
         
         if was_no_dates != now_no_dates:
             has_meaningful_change = True
@@ -276,7 +343,7 @@ def _format_policy_change(detail: Dict) -> str:
 
 def _get_recommendations(category: str, priority: str, added: List[str], removed: List[str], changed: List[Dict]) -> List[str]:
     """Генерирует рекомендации на основе категории и приоритета"""
-    recs = []
+    recs: List[str] = []
     
     if "КРИТИЧНО" in priority:
         if category == "api":
@@ -314,7 +381,7 @@ def _get_recommendations(category: str, priority: str, added: List[str], removed
 
 def group_changes_by_region(details: List[Dict]) -> Dict[str, List[Dict]]:
     """Группирует изменения по регионам для отправки в одном сообщении"""
-    grouped = {}
+    grouped: Dict[str, List[Dict]] = {}
     
     for detail in details:
         region = detail.get("region", "GLOBAL")
@@ -329,27 +396,33 @@ def group_changes_by_region(details: List[Dict]) -> Dict[str, List[Dict]]:
     
     return grouped
 
+_SEPARATOR = "━━━━━━━━━━━━━━━━━━━━━━"
+
+
+def _global_header(region_badge: str) -> str:
+    return f"{region_badge} <b>ГЛОБАЛЬНЫЕ ИЗМЕНЕНИЯ</b>\n📍 Обновления для всех регионов\n{_SEPARATOR}\n"
+
+
+# Заголовок + разделитель + пустая строка — одной строкой, собираются один раз при импорте
+_REGION_HEADERS = {
+    "MD": f"🇲🇩 <b>МОЛДОВА (MD)</b>\n📍 Обновления для молдавского региона\n{_SEPARATOR}\n",
+    "EU": f"🇪🇺 <b>ЕВРОПА (EU)</b>\n📍 Обновления для европейского региона\n{_SEPARATOR}\n",
+    **{r: _global_header(badge) for r, badge in REGION_BADGES.items() if r not in ("MD", "EU")},
+}
+
+
 def format_region_summary(region: str, details: List[Dict]) -> List[str]:
     """Форматирует сводку изменений для региона"""
     if not details:
         return []
     
-    region_badge = REGION_BADGES.get(region, f"🌍 [{region}]")
-    output = []
+    output: List[str] = []
     
-    # Заголовок региона
-    if region == "MD":
-        output.append(f"🇲🇩 <b>МОЛДОВА ({region})</b>")
-        output.append(f"📍 Обновления для молдавского региона")
-    elif region == "EU":
-        output.append(f"🇪🇺 <b>ЕВРОПА ({region})</b>")
-        output.append(f"📍 Обновления для европейского региона")
-    else:
-        output.append(f"{region_badge} <b>ГЛОБАЛЬНЫЕ ИЗМЕНЕНИЯ</b>")
-        output.append(f"📍 Обновления для всех регионов")
-    
-    output.append(f"━━━━━━━━━━━━━━━━━━━━━━")
-    output.append("")
+    # Заголовок региона (для известных регионов — готовая строка)
+    header = _REGION_HEADERS.get(region)
+    if header is None:
+        header = _global_header(REGION_BADGES.get(region, f"🌍 [{region}]"))
+    output.append(header)
     
     # Форматируем каждое изменение в регионе
     for i, detail in enumerate(details, 1):
@@ -362,19 +435,14 @@ def format_region_summary(region: str, details: List[Dict]) -> List[str]:
         removed = gd.get("removed") or []
         
         # Оценка приоритета
-        priority_text, priority_icon = _assess_priority(
-            " ".join([p.get("was", "") for p in changed]),
-            " ".join([p.get("now", "") for p in changed]),
-            added,
-            removed
-        )
+        priority_text, priority_icon = _assess_priority(*_joined_pairs(changed), added, removed)
         
         output.append(f"<b>{i}. {escape(title)}</b> {priority_icon}")
         
         # Краткое описание изменений
         changes_count = len(changed) + len(added) + len(removed)
         if changes_count > 0:
-            change_parts = []
+            change_parts: List[str] = []
             if added:
                 change_parts.append(f"+{len(added)}")
             if removed:
@@ -385,7 +453,7 @@ def format_region_summary(region: str, details: List[Dict]) -> List[str]:
             output.append(f"📊 Изменения: {' '.join(change_parts)}")
         
         # Ключевые изменения (максимум 2 для краткости)
-        key_changes = []
+        key_changes: List[str] = []
         for pair in changed[:2]:  # Только первые 2
             was = pair.get("was", "")
             now = pair.get("now", "")
@@ -427,22 +495,27 @@ def format_change_smart(detail: Dict) -> List[str]:
         
         # Разбиваем на блоки по 3500 символов
         MAX_LEN = 3500
-        blocks = []
+        blocks: List[str] = []
         if len(formatted) <= MAX_LEN:
             blocks.append(formatted)
         else:
-            # Простое разбиение по абзацам
-            lines = formatted.split("\n")
-            current_block = ""
-            for line in lines:
-                if len(current_block) + len(line) + 1 > MAX_LEN:
-                    if current_block:
-                        blocks.append(current_block)
-                    current_block = line
+            # Простое разбиение по абзацам: строки копим списком, длину блока считаем сами
+            # (без конкатенации строк на каждой итерации)
+            current_lines: List[str] = []
+            current_len = 0
+            for line in formatted.split("\n"):
+                if current_len + len(line) + 1 > MAX_LEN:
+                    if current_len:
+                        blocks.append("\n".join(current_lines))
+                    current_lines, current_len = [line], len(line)
+                elif current_len:
+                    current_lines.append(line)
+                    current_len += len(line) + 1
                 else:
-                    current_block += ("\n" if current_block else "") + line
-            if current_block:
-                blocks.append(current_block)
+                    # пустой блок: строка становится его началом (пустые строки в начале блока не копятся)
+                    current_lines, current_len = [line], len(line)
+            if current_len:
+                blocks.append("\n".join(current_lines))
         
         return blocks
     
@@ -452,3 +525,12 @@ def format_change_smart(detail: Dict) -> List[str]:
         title = detail.get("title", "")
         url = detail.get("url", "")
         return [f"• <b>{escape(title)}</b>\n\n⚠️ Обнаружены изменения\n\n🔗 {escape(url)}"]
+
+
+def format_changes_batch(details: List[Dict]) -> List[List[str]]:
+    """
+    format_change_smart для списка изменений; результат — в том же порядке.
+    Последовательно: ~1 мс на изменение, а пул процессов (spawn) стартует сотни мс и
+    заново импортирует __main__ бота. Вызывающие уводят вызов с event loop (asyncio.to_thread).
+    """
+    return [format_change_smart(d) for d in details]
@@ -13,34 +13,86 @@ except ImportError:
     def backup_to_gist(data): return False
     def restore_from_gist(): return None
 
+# orjson (C-сериализация, сразу bytes) — опционально, иначе стандартный json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 ROOT = Path(os.getenv("PROJECT_ROOT") or Path(__file__).resolve().parents[1])
 DATA_DIR = ROOT / "data" / "cache"
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 CACHE_FILE = DATA_DIR / "cache.json"
+# Отступы в cache.json — только для ручной отладки/диффа (CACHE_PRETTY_JSON=1)
+CACHE_PRETTY_JSON = os.getenv("CACHE_PRETTY_JSON", "0") == "1"
 
 def _now_iso() -> str:
     return datetime.datetime.utcnow().replace(microsecond=0).isoformat() + "Z"
 
+# Разобранный cache.json в памяти; валиден, пока не изменились mtime/размер файла.
+# digest — хэш байтов файла: одинаковое содержимое не переписываем;
+# backed_up — это же содержимое уже успешно ушло в Gist
+_CACHE_MEM = {"stamp": None, "data": None, "digest": None, "backed_up": False}
+
+def _file_stamp():
+    try:
+        st = CACHE_FILE.stat()
+    except OSError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def _copy_json(obj):
+    # Глубокая копия JSON-данных (dict/list/скаляры): быстрее copy.deepcopy — без memo и диспетчеризации по типам
+    if isinstance(obj, dict):
+        return {k: _copy_json(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [_copy_json(v) for v in obj]
+    return obj
+
+def _copy_cache(data: dict) -> dict:
+    # Копия для вызывающего: pipeline правит список, записи и вложенные sections/global_diff на месте —
+    # общий снимок трогать нельзя, поэтому копия глубокая
+    return _copy_json(data)
+
+def _load_cache_shared():
+    """Общий (только для чтения!) снимок cache.json; перечитывает файл лишь при его изменении."""
+    stamp = _file_stamp()
+    if stamp is None:
+        return None
+    if stamp == _CACHE_MEM["stamp"]:
+        return _CACHE_MEM["data"]
+
+    raw = CACHE_FILE.read_bytes()
+    data = _normalize_cache(_load_json_bytes(raw))
+    _CACHE_MEM.update(stamp=stamp, data=data, digest=_payload_digest(raw), backed_up=False)
+    return data
+
+def _payload_digest(payload: bytes) -> bytes:
+    return hashlib.sha256(payload, usedforsecurity=False).digest()
+
+def _normalize_cache(data) -> dict:
+    # ✅ Back-compat: раньше cache.json был списком; теперь — {"items":[...]}
+    if isinstance(data, list):
+        data = {"items": data}
+    elif not isinstance(data, dict):
+        data = {"items": []}
+    # гарантия ключа
+    if "items" not in data or not isinstance(data["items"], list):
+        data["items"] = []
+
+    # ✨ Back-compat: добавляем region=GLOBAL для старых записей
+    for item in data["items"]:
+        if "region" not in item:
+            item["region"] = "GLOBAL"
+    return data
+
 def load_cache() -> dict:
     # Сначала пробуем загрузить из локального файла
     if CACHE_FILE.exists():
         try:
-            data = json.loads(CACHE_FILE.read_text(encoding="utf-8"))
-            # ✅ Back-compat: раньше cache.json был списком; теперь — {"items":[...]}
-            if isinstance(data, list):
-                data = {"items": data}
-            elif not isinstance(data, dict):
-                data = {"items": []}
-            # гарантия ключа
-            if "items" not in data or not isinstance(data["items"], list):
-                data["items"] = []
-            
-            # ✨ Back-compat: добавляем region=GLOBAL для старых записей
-            for item in data["items"]:
-                if "region" not in item:
-                    item["region"] = "GLOBAL"
-            
-            return data
+            data = _load_cache_shared()
+            if data is not None:
+                return _copy_cache(data)
         except Exception:
             pass
     
@@ -61,44 +113,104 @@ def load_cache() -> dict:
     return {"items": []}
 
 def save_cache(data: dict) -> None:
-    # Атомарная запись JSON (временный файл + переименование)
+    # Атомарная запись JSON (временный файл + переименование).
+    # Без отступов (кроме CACHE_PRETTY_JSON): full_text по всем источникам, pretty-print раздувает файл и время записи
     tmp_file = CACHE_FILE.with_suffix('.tmp')
+    if isinstance(data, dict):
+        # свежайший ts считаем один раз при записи — get_cache_stats не сканирует записи
+        # (новый dict: старый meta может быть общим с закэшированным снимком)
+        data["meta"] = {**(data.get("meta") or {}), "latest_ts": _latest_ts(data.get("items") or [])}
     try:
-        with open(tmp_file, 'w', encoding='utf-8') as tf:
-            json.dump(data, tf, ensure_ascii=False, indent=2)
+        payload = _dump_json_bytes(data)
+        digest = _payload_digest(payload)
+        if digest == _CACHE_MEM["digest"] and _CACHE_MEM["stamp"] is not None and _file_stamp() == _CACHE_MEM["stamp"]:
+            # на диске уже ровно это содержимое — не переписываем
+            log.debug("cache.json не изменился, запись пропущена")
+            if BACKUP_ENABLED and not _CACHE_MEM["backed_up"]:
+                _CACHE_MEM["backed_up"] = bool(backup_to_gist(data))
+            return
+        tmp_file.write_bytes(payload)
         os.replace(tmp_file, CACHE_FILE)
+        # только что записанное — сразу в память, без повторного чтения/разбора
+        if isinstance(data, dict):
+            _CACHE_MEM.update(stamp=_file_stamp(), data=_normalize_cache(_copy_cache(data)), digest=digest, backed_up=False)
+        else:
+            _CACHE_MEM.update(stamp=None, data=None, digest=None, backed_up=False)
         
         # Автоматическое резервное копирование в Gist (если настроено)
         if BACKUP_ENABLED:
-            backup_to_gist(data)
+            _CACHE_MEM["backed_up"] = bool(backup_to_gist(data))
     except Exception:
         raise
 
+def _dump_json_bytes(data: dict) -> bytes:
+    """Компактный UTF-8 JSON; orjson, если установлен."""
+    if orjson is not None:
+        opts = orjson.OPT_NON_STR_KEYS | (orjson.OPT_INDENT_2 if CACHE_PRETTY_JSON else 0)
+        try:
+            return orjson.dumps(data, option=opts)
+        except TypeError:
+            pass  # экзотические типы/огромные int — пусть разбирается стандартный json
+    if CACHE_PRETTY_JSON:
+        return json.dumps(data, ensure_ascii=False, indent=2).encode("utf-8")
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+def _load_json_bytes(raw: bytes):
+    if orjson is not None:
+        return orjson.loads(raw)
+    return json.loads(raw)
+
+# Длинный текст (сырой HTML страниц) хэшируем кусками — без полной UTF-8 копии в памяти
+_HASH_CHUNK = 1 << 16
+
 def compute_hash(text: str) -> str:
-    return hashlib.sha256(text.encode("utf-8", errors="ignore")).hexdigest()
+    # Хэш — ключ кэша (items[].hash, trans_cache), не криптография.
+    # Алгоритм не меняем: сохранённые сигнатуры должны оставаться валидными.
+    if len(text) <= _HASH_CHUNK:
+        return hashlib.sha256(text.encode("utf-8", errors="ignore"), usedforsecurity=False).hexdigest()
+    # UTF-8 кодирует каждый символ независимо (и так же отбрасывает одиночные суррогаты),
+    # поэтому дайджест совпадает с хэшем целиком закодированной строки
+    h = hashlib.sha256(usedforsecurity=False)
+    for i in range(0, len(text), _HASH_CHUNK):
+        h.update(text[i:i + _HASH_CHUNK].encode("utf-8", errors="ignore"))
+    return h.hexdigest()
+
+def _latest_ts(items: list):
+    """
+    Самый свежий ts среди записей или None.
+    ts пишет pipeline в одном формате (UTC isoformat до секунд), такие строки
+    упорядочены лексикографически — сравниваем строки, без разбора в datetime.
+    """
+    stamps = (it.get("ts") for it in items if isinstance(it, dict))
+    return max((ts for ts in stamps if ts and isinstance(ts, str)), default=None)
+
+def cache_stamp():
+    """(mtime_ns, size) файла кэша или None — ключ для производных кэшей у вызывающих."""
+    return _file_stamp()
 
 def get_items() -> list:
     return load_cache().get("items", [])
 
 def get_cache_stats() -> dict:
     """Возвращает статистику кэша. Число источников — по текущему config.SOURCES."""
-    data = load_cache()
+    # только чтение — копия не нужна
+    try:
+        data = _load_cache_shared()
+    except Exception:
+        data = None
+    if data is None:
+        data = load_cache()
     items = data.get("items", []) if data else []
     sources_configured = len(SOURCES)  # ← динамически, отражает актуальный config.json
     page_size = PAGE_SIZE
     max_cache = MAX_ITEMS_TOTAL or len(items)
 
-    latest = None
-    for it in items:
-        ts = it.get("ts")
-        if ts:
-            try:
-                dt = datetime.datetime.fromisoformat(ts)
-            except Exception:
-                continue
-            if not latest or dt > latest:
-                latest = dt
-    latest_iso = latest.isoformat(timespec="seconds") if latest else datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+    meta = (data or {}).get("meta") or {}
+    if "latest_ts" in meta:
+        latest = meta["latest_ts"]
+    else:
+        latest = _latest_ts(items)  # Back-compat: кэш записан до появления meta
+    latest_iso = latest or datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
     return {
         "sources_configured": sources_configured,
         "items_cached": len(items),
@@ -8,18 +8,20 @@
 """
 from __future__ import annotations
 
-import hashlib
 import os
 import re
-from typing import Tuple, List, Dict
+from typing import Tuple, List, Dict, Union
 
 from bs4 import BeautifulSoup
 from .llm_client import chat, LLMError  # используем общий клиент
+from .storage import compute_hash
 
 DEFAULT_LANG = os.getenv("LLM_OUTPUT_LANG", "ru")
 _WHITESPACE_RE = re.compile(r"[ \t\x0a]+")
 
 STRIP_TAGS = {"script", "style", "nav", "footer", "header", "noscript", "template", "iframe"}
+_SECTION_TAGS = ("h2", "h3", "p", "li")
+_SECTION_SCAN_TAGS = sorted(STRIP_TAGS) + list(_SECTION_TAGS)
 
 # шумовые конструкции (даты/обновления/служебные хвосты)
 _NOISE_RE = re.compile(
@@ -31,24 +33,39 @@ _NOISE_RE = re.compile(
 
 _TAIL_RE = re.compile(r"(?im)^(Назад к .*?|Back to .*?|Help Center|Справочный центр).*$")
 
+_SPACES_RE = re.compile(r"\s+")
+_MULTI_SPACE_RE = re.compile(r"\s{2,}")
+
 
 def compute_sig(text: str) -> str:
-    return hashlib.sha256(text.encode("utf-8", errors="ignore")).hexdigest()
+    # та же функция, что и для page_sig: сигнатуры секций лежат в кэше, алгоритм не меняем
+    return compute_hash(text)
 
 
 def normalize_plain(plain: str) -> str:
     """Стабилизируем текст для подсчёта хэша/сигнатур (минус шум и даты)."""
-    s = (plain or "").strip()
-    s = re.sub(r"\s+", " ", s)
-    s = _NOISE_RE.sub("", s)
-    s = _TAIL_RE.sub("", s)
-    s = re.sub(r"\s{2,}", " ", s).strip()
+    # Результат идёт в сигнатуры секций — вывод должен совпадать с прежним побайтно.
+    # После схлопывания пробелов перевода строк нет: ^ хвоста срабатывает только
+    # в начале строки и забирает её целиком, поэтому вместо sub достаточно match.
+    s = _SPACES_RE.sub(" ", (plain or "").strip())
+    s, removed = _NOISE_RE.subn("", s)
+    if _TAIL_RE.match(s):
+        return ""
+    if removed:
+        # двойные пробелы/края могли появиться только на месте вырезанного шума
+        s = _MULTI_SPACE_RE.sub(" ", s).strip()
     return s
 
 
+def _make_soup(html: str) -> BeautifulSoup:
+    # тот же парсер, что и в html_clean (html.parser): сигнатуры секций не должны зависеть
+    # от того, пришло сюда готовое дерево или строка, и не должны меняться между версиями
+    return BeautifulSoup(html or "", "html.parser")
+
+
 def text_from_html(html: str) -> Tuple[str, str]:
     """Вернуть (title, text) без мусора."""
-    soup = BeautifulSoup(html or "", "html.parser")
+    soup = _make_soup(html)
     title = (soup.title.string or "").strip() if soup.title and soup.title.string else ""
 
     for tag in list(soup.find_all(STRIP_TAGS)):
@@ -68,14 +85,19 @@ def _slug(s: str) -> str:
     return s or "section"
 
 
-def extract_sections(html: str) -> List[Dict[str, str]]:
+def extract_sections(html: Union[str, BeautifulSoup]) -> List[Dict[str, str]]:
     """
     Разбор на секции: каждая начинается с h2/h3, затем все p/li до следующего заголовка.
+    Принимает HTML-строку или уже разобранное дерево (оно будет изменено).
     Возвращает список dict: {id, title, text, sig}
     """
-    soup = BeautifulSoup(html or "", "html.parser")
-    for tag in list(soup.find_all(STRIP_TAGS)):
-        tag.decompose()
+    soup = html if isinstance(html, BeautifulSoup) else _make_soup(html)
+    # один обход дерева: сразу и мусорные теги, и заголовки/абзацы (в порядке документа)
+    nodes = soup.find_all(_SECTION_SCAN_TAGS)
+    # сначала вырезаем мусор целиком — иначе его текст попал бы в get_text() родительского <p>/<li>
+    for node in nodes:
+        if not node.decomposed and node.name in STRIP_TAGS:
+            node.decompose()
 
     sections: List[Dict[str, str]] = []
     current_title = None
@@ -97,7 +119,9 @@ def extract_sections(html: str) -> List[Dict[str, str]]:
         )
         current_title, current_buf = None, []
 
-    for node in soup.find_all(["h2", "h3", "p", "li"]):
+    for node in nodes:
+        if node.decomposed:  # сам мусор или лежал внутри него
+            continue
         name = node.name.lower()
         if name in ("h2", "h3"):
             # новая секция
@@ -1,32 +1,179 @@
 # -*- coding: utf-8 -*-
 import os
+import time
 import httpx
 import asyncio
 import logging
+import json
+from contextlib import asynccontextmanager
+from typing import Dict, Optional
 
 log = logging.getLogger(__name__)
 
+# orjson (C-сериализация, сразу bytes) — опционально, иначе стандартный json
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN", "")
 CHAT_ID = os.getenv("TELEGRAM_CHAT_ID", "")
 DEV_CHAT_ID = os.getenv("TELEGRAM_DEV_CHAT_ID", "")  # новый
-MAX_LEN = 3500
+_SEND_URL = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage" if BOT_TOKEN else ""
+MAX_LEN = 3900  # лимит Telegram 4096 символов, запас под HTML-сущности
+
+# Один клиент на процесс: keep-alive к api.telegram.org вместо TCP+TLS на каждый notify()
+_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=20)
+# HTTP/2 (пакет h2, httpx[http2]) — параллельные sendMessage идут одним соединением; без h2 — HTTP/1.1
+try:
+    import h2  # noqa: F401
+    _HTTP2 = True
+except ImportError:
+    _HTTP2 = False
+_client: Optional[httpx.AsyncClient] = None
+_client_loop: Optional[asyncio.AbstractEventLoop] = None
+
+def _get_client() -> httpx.AsyncClient:
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    # соединения привязаны к event loop — на новом loop (или после aclose) создаём заново
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = httpx.AsyncClient(http2=_HTTP2, timeout=20, limits=_LIMITS)
+        _client_loop = loop
+    return _client
+
+# Лимиты Telegram: общий поток запросов и ~1 сообщение/сек в один чат.
+# Общие для всех отправок процесса (notify и бот через send_slot).
+# Компромисс: 1 с на группу/канал (id с «-» или @username) медленнее прежних пауз 0.2–0.3 с,
+# зато без 429 на длинных рассылках. Личные чаты (положительный id) переносят короткие серии —
+# для них интервал меньше, на уровне прежнего темпа; 429 всё равно обрабатывается повтором
+TG_SEND_CONCURRENCY = int(os.getenv("TG_SEND_CONCURRENCY", "20"))
+TG_CHAT_MIN_INTERVAL = float(os.getenv("TG_CHAT_MIN_INTERVAL", "1.0"))
+TG_PRIVATE_CHAT_MIN_INTERVAL = float(os.getenv("TG_PRIVATE_CHAT_MIN_INTERVAL", "0.25"))
+_SEND_SEM = asyncio.Semaphore(TG_SEND_CONCURRENCY)
+_chat_next_ts: Dict[str, float] = {}  # chat_id -> время, раньше которого в этот чат не шлём
+
+@asynccontextmanager
+async def send_slot(chat_id):
+    """Ждёт очереди чата, затем место в общем лимите параллельных запросов."""
+    # Резервируем слот без lock: между чтением и записью нет await (однопоточный event loop)
+    key = str(chat_id)
+    interval = TG_PRIVATE_CHAT_MIN_INTERVAL if key.isdigit() else TG_CHAT_MIN_INTERVAL
+    now = time.monotonic()
+    start = max(now, _chat_next_ts.get(key, 0.0))
+    _chat_next_ts[key] = start + interval
+    if start > now:
+        await asyncio.sleep(start - now)
+    async with _SEND_SEM:
+        yield
+
+async def aclose() -> None:
+    """Закрывает общий клиент (при остановке процесса)."""
+    global _client
+    if _client is not None:
+        try:
+            await _client.aclose()
+        except Exception as e:
+            log.debug("telegram client close failed: %s", e)
+        _client = None
 
 def _parse_ids(s: str):
     return [p.strip() for p in (s or "").split(",") if p.strip()]
 
+# CHAT_ID читается один раз при импорте — и разбирается тоже один раз
+_IDS = _parse_ids(CHAT_ID)
+
+def _retry_after(resp: httpx.Response) -> float:
+    """Сколько ждать после 429: parameters.retry_after из ответа Bot API (или заголовок Retry-After)."""
+    try:
+        return float(resp.json().get("parameters", {}).get("retry_after"))
+    except Exception:
+        pass
+    try:
+        return float(resp.headers.get("retry-after", "1"))
+    except ValueError:
+        return 1.0
+
+def _chunk_text(text: str, max_len: int) -> list[str]:
+    """
+    Режет текст на куски ≤ max_len по границам строк: строки (splitlines, в C) жадно
+    складываются в кусок, пока он влезает; строка длиннее max_len режется жёстко по длине.
+    Куски уже обрезаны по краям (strip) и не пустые — _send отправляет их как есть.
+    """
+    if len(text) <= max_len:
+        text = text.strip()
+        return [text] if text else []  # обычный случай — одно сообщение
+
+    chunks: list[str] = []
+    buf: list[str] = []
+    buf_len = 0
+
+    def _flush():
+        nonlocal buf, buf_len
+        chunk = "".join(buf).strip()
+        if chunk:
+            chunks.append(chunk)
+        buf, buf_len = [], 0
+
+    for line in text.splitlines(keepends=True):
+        if buf_len + len(line) > max_len and buf:
+            _flush()
+        while len(line) > max_len:
+            buf = [line[:max_len]]
+            _flush()
+            line = line[max_len:]
+        buf.append(line)
+        buf_len += len(line)
+    _flush()
+    return chunks
+
+# Повторы при сбоях сети и 5xx: паузы 0.5 → 1 с между попытками; 4xx не повторяем
+_SEND_ATTEMPTS = 3
+_RETRY_BASE_DELAY = 0.5
+
+_JSON_HEADERS = {"Content-Type": "application/json"}
+
+def _dump_payload(payload: dict) -> bytes:
+    """Тело запроса Bot API; кодируем один раз на сообщение — повторы шлют те же байты."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(payload)
+        except TypeError:
+            pass  # напр. одиночные суррогаты в тексте — json экранирует их как \uXXXX
+    return json.dumps(payload).encode("ascii")
+
+async def _post_with_retry(client: httpx.AsyncClient, chat_id: str, url: str, body: bytes) -> httpx.Response:
+    for attempt in range(_SEND_ATTEMPTS):
+        last = attempt == _SEND_ATTEMPTS - 1
+        try:
+            async with send_slot(chat_id):
+                resp = await client.post(url, content=body, headers=_JSON_HEADERS)
+            if resp.status_code < 500 or last:
+                return resp
+        except (httpx.TimeoutException, httpx.NetworkError):
+            if last:
+                raise
+        await asyncio.sleep(_RETRY_BASE_DELAY * 2 ** attempt)
+
 async def _send(client: httpx.AsyncClient, chat_id: str, text: str) -> bool:
     """Отправляет сообщение в Telegram. Возвращает True если успешно, False если чат не найден."""
-    if not BOT_TOKEN or not chat_id:
+    if not _SEND_URL or not chat_id:
         return False
-    url = f"https://api.telegram.org/bot{BOT_TOKEN}/sendMessage"
     payload = {
         "chat_id": chat_id,
-        "text": text.strip(),
+        "text": text,
         "parse_mode": "HTML",
         "disable_web_page_preview": True
     }
+    body = _dump_payload(payload)
     try:
-        resp = await client.post(url, json=payload)
+        resp = await _post_with_retry(client, chat_id, _SEND_URL, body)
+        if resp.status_code == 429:
+            # упёрлись в лимит Telegram: ждём, сколько он просит, и повторяем один раз
+            delay = _retry_after(resp)
+            log.warning(f"Telegram 429 для чата {chat_id}, повтор через {delay:.0f} с")
+            await asyncio.sleep(delay)
+            resp = await _post_with_retry(client, chat_id, _SEND_URL, body)
         resp.raise_for_status()
         return True
     except httpx.HTTPStatusError as e:
@@ -40,51 +187,44 @@ async def _send(client: httpx.AsyncClient, chat_id: str, text: str) -> bool:
     except Exception:
         raise
 
+async def _send_collect(client: httpx.AsyncClient, chat_id: str, text: str, errors: list) -> bool:
+    """_send для gather: ошибку копим в errors (лог — одной записью в notify), наружу — признак успеха."""
+    try:
+        return await _send(client, chat_id, text)
+    except Exception as e:
+        errors.append(f"чат {chat_id}: {e}")
+        return True  # чат живой, просто сбой отправки — следующие куски пробуем
+
 async def notify(text: str) -> None:
     if not BOT_TOKEN or not CHAT_ID:
         return
-    chunks = []
-    while len(text) > MAX_LEN:
-        split_idx = text[:MAX_LEN].rfind("\n")
-        if split_idx == -1:
-            split_idx = MAX_LEN
-        chunks.append(text[:split_idx])
-        text = text[split_idx:]
-    chunks.append(text)
-
-    ids = _parse_ids(CHAT_ID)
+    chunks = _chunk_text(text, MAX_LEN)
+
+    ids = _IDS
     failed_chats = []  # Список чатов, которые не удалось отправить
+    errors: list[str] = []
     
-    async with httpx.AsyncClient(timeout=20) as client:
-        for chunk in chunks:
-            for cid in ids:
-                if cid in failed_chats:  # Пропускаем чаты, которые уже не работают
-                    continue
-                try:
-                    success = await _send(client, cid, chunk)
-                    if not success:
-                        failed_chats.append(cid)
-                    await asyncio.sleep(0.3)
-                except Exception as e:
-                    log.error(f"Не удалось отправить сообщение в Telegram (чат {cid}): {e}")
+    client = _get_client()
+    for chunk in chunks:
+        # кусок уходит во все чаты одновременно; порядок кусков внутри чата сохраняется
+        active = [cid for cid in ids if cid not in failed_chats]  # Пропускаем чаты, которые уже не работают
+        if not active:
+            break
+        results = await asyncio.gather(*(_send_collect(client, cid, chunk, errors) for cid in active))
+        failed_chats.extend(cid for cid, ok in zip(active, results) if not ok)
+
+    if errors:
+        log.error(f"Не удалось отправить в Telegram {len(errors)} сообщ.: " + "; ".join(errors[:10]))
 
 async def notify_dev(text: str) -> None:
-    cid = DEV_CHAT_ID or (_parse_ids(CHAT_ID)[0] if CHAT_ID else "")
+    cid = DEV_CHAT_ID or (_IDS[0] if _IDS else "")
     if not cid or not BOT_TOKEN:
         return
-    chunks = []
-    while len(text) > MAX_LEN:
-        split_idx = text[:MAX_LEN].rfind("\n")
-        if split_idx == -1:
-            split_idx = MAX_LEN
-        chunks.append(text[:split_idx])
-        text = text[split_idx:]
-    chunks.append(text)
-
-    async with httpx.AsyncClient(timeout=20) as client:
-        for chunk in chunks:
-            try:
-                await _send(client, cid, chunk)
-                await asyncio.sleep(0.2)
-            except Exception as e:
-                log.error(f"Не удалось отправить dev-сообщение в Telegram: {e}")
+    chunks = _chunk_text(text, MAX_LEN)
+
+    client = _get_client()
+    for chunk in chunks:
+        try:
+            await _send(client, cid, chunk)
+        except Exception as e:
+            log.error(f"Не удалось отправить dev-сообщение в Telegram: {e}")
@@ -3,15 +3,20 @@ import logging
 import os
 import asyncio
 import datetime
+from functools import lru_cache
 from logging.handlers import RotatingFileHandler
 from zoneinfo import ZoneInfo
 from dotenv import load_dotenv
 
 from telegram import BotCommand
+from telegram.error import RetryAfter
 from telegram.ext import Application, ApplicationBuilder
 
 from .handlers import setup_handlers, _sanitize_telegram_html, _is_meaningful_change  # используем форматтер из handlers
-from ..pipeline import run_update
+# настройки и проверка автоперевода — общие с ручными обновлениями
+from .handlers import MAX_NOTIFY_CHARS, _TRANSLATE_SEM, _needs_translation
+from ..pipeline import run_update, aclose_http_clients
+from .. import telegram_notify
 from ..llm_client import translate_compact_html  # автоперевод/сжатие
 from ..smart_formatter import format_change_smart  # умное форматирование
 from ..config import LOGS_DIR
@@ -58,11 +63,15 @@ def _tune_lib_loggers():
 # ──────────────────────────────────────────────────────────────
 # 3) Утилиты рассылки
 # ──────────────────────────────────────────────────────────────
-def _parse_chat_ids() -> list[int]:
-    """Парсит TELEGRAM_CHAT_ID как список (поддерживает , ; \n \t и лишние пробелы)."""
+@lru_cache(maxsize=1)
+def _parse_chat_ids() -> tuple[int, ...]:
+    """
+    Парсит TELEGRAM_CHAT_ID как список (поддерживает , ; \n \t и лишние пробелы).
+    Окружение в рантайме не меняется — разбираем один раз (первый вызов — уже после _load_env).
+    """
     raw = os.getenv("TELEGRAM_CHAT_ID", "").strip()
     if not raw:
-        return []
+        return ()
     # нормализуем разделители
     sep_normalized = raw.replace(";", ",").replace("\n", ",").replace("\t", ",")
     out: list[int] = []
@@ -82,8 +91,9 @@ def _parse_chat_ids() -> list[int]:
         if cid not in seen:
             seen.add(cid)
             uniq.append(cid)
-    return uniq
+    return tuple(uniq)
 
+@lru_cache(maxsize=1)
 def _dev_id() -> int | None:
     # по твоей просьбе dev по умолчанию = 527824690
     raw = os.getenv("TELEGRAM_DEV_CHAT_ID", "527824690").strip()
@@ -92,28 +102,66 @@ def _dev_id() -> int | None:
     except Exception:
         return None
 
-def _needs_translation(s: str, max_len: int) -> bool:
-    import re
-    en = len(re.findall(r"[A-Za-z]", s))
-    total = max(1, len(s))
-    return en / total > 0.15 or len(s) > max_len
-
 # ──────────────────────────────────────────────────────────────
 # 4) Ежедневная задача
 # ──────────────────────────────────────────────────────────────
-AUTO_TRANSLATE = os.getenv("AUTO_TRANSLATE_DIFFS", "1") == "1"
-MAX_NOTIFY_CHARS = int(os.getenv("MAX_NOTIFY_CHARS", "1400"))
+_PART_SEP = "\n\n"  # между частями, склеенными в одно сообщение
 
 async def _send_html(application: Application, chat_id: int, text: str):
+    for attempt in range(2):
+        try:
+            # общие с telegram_notify лимиты: параллельность и темп на чат
+            async with telegram_notify.send_slot(chat_id):
+                await application.bot.send_message(chat_id=chat_id, text=text, parse_mode="HTML", disable_web_page_preview=True)
+            return
+        except RetryAfter as e:
+            # 429: ждём, сколько просит Telegram, и повторяем один раз
+            if attempt:
+                log.error("send_message failed: %s", e)
+                return
+            delay = e.retry_after.total_seconds() if hasattr(e.retry_after, "total_seconds") else float(e.retry_after)
+            log.warning("Telegram 429 для чата %s, повтор через %.0f с", chat_id, delay)
+            await asyncio.sleep(delay)
+        except Exception as e:
+            log.error("send_message failed: %s", e)
+            return
+
+async def _broadcast_html(application: Application, chat_ids: list[int], text: str):
+    """Одно сообщение всем получателям параллельно (_send_html сам логирует свои ошибки)."""
+    await asyncio.gather(*(_send_html(application, cid, text) for cid in chat_ids))
+
+# Диффы между запусками меняются медленно: одинаковые части не переводим/не чистим повторно.
+# Ошибки lru_cache не запоминает — неудачный перевод повторится в следующий раз.
+# Чистка тегов нужна только ответу LLM: smart_formatter сам выдаёт лишь <b>/<i>/<a> и экранированный текст
+@lru_cache(maxsize=256)
+def _cached_translate(s: str, max_len: int) -> str:
+    return _sanitize_telegram_html(translate_compact_html(s, target_lang="ru", max_len=max_len))
+
+async def _translate_part(part: str) -> str:
+    """Автоперевод/сжатие части рассылки (уже очищенный под Telegram); при ошибке — исходный текст."""
+    if not _needs_translation(part):
+        return part
     try:
-        await application.bot.send_message(chat_id=chat_id, text=text, parse_mode="HTML", disable_web_page_preview=True)
-    except Exception as e:
-        log.error("send_message failed: %s", e)
+        # лимит параллельных переводов — общий с ручными обновлениями (handlers)
+        async with _TRANSLATE_SEM:
+            return await asyncio.to_thread(_cached_translate, part, MAX_NOTIFY_CHARS)
+    except Exception:
+        return part
+
+# Рассылка может идти долго (перевод LLM); новый запуск поверх незавершённого пропускаем
+_DAILY_LOCK = asyncio.Lock()
 
 async def _daily_job(context):
+    if _DAILY_LOCK.locked():
+        log.warning("Ежедневная рассылка ещё идёт — повторный запуск пропущен")
+        return
+    async with _DAILY_LOCK:
+        await _run_daily(context)
+
+async def _run_daily(context):
     app: Application = context.application
     dev_only = os.getenv("DAILY_DEV_ONLY", "0") == "1"  # опционально: рассылать только dev
-    recipients = [_dev_id()] if dev_only else _parse_chat_ids()
+    recipients = [_dev_id()] if dev_only else list(_parse_chat_ids())
     recipients = [x for x in recipients if x]
 
     if not recipients:
@@ -134,39 +182,41 @@ async def _daily_job(context):
         
         if not meaningful_details:
             msg = f"🟢 Всего изменений: {len(details)}\nЗначимых для таргетинга: 0\n\n🟢 Все изменения незначительные (обновление дат, версий)."
-            for cid in recipients:
-                await _send_html(app, cid, msg)
+            await _broadcast_html(app, recipients, msg)
             return
 
         # Группируем изменения по регионам для объединенной отправки
         from ..smart_formatter import group_changes_by_region, format_region_summary
         grouped_by_region = group_changes_by_region(meaningful_details)
         
-        # Отправляем сводку по каждому региону в одном сообщении
-        for region in sorted(grouped_by_region.keys()):
-            region_details = grouped_by_region[region]
-            if not region_details:
+        # Сводка по каждому региону — одно сообщение; сначала форматируем все регионы
+        all_parts = [
+            part
+            for region in sorted(grouped_by_region.keys())
+            if grouped_by_region[region]
+            for part in format_region_summary(region, grouped_by_region[region])
+        ]
+
+        # Переводы (LLM) стартуют сразу все — параллельно и вне event loop.
+        # Забираем их по порядку: первое сообщение уходит, пока следующие ещё переводятся
+        tasks = [asyncio.create_task(_translate_part(p)) for p in all_parts]
+
+        # Короткие части склеиваем в сообщения до лимита Telegram — меньше отправок.
+        # Рассылка строго по порядку сообщений; каждое — всем получателям сразу.
+        # Темп держит send_slot (≈1 сообщение/сек в чат), 429 — повтор по retry_after
+        pending: list[str] = []
+        pending_len = 0
+        for task in tasks:
+            out = await task
+            if not out:
                 continue
-                
-            # Форматируем сводку для региона
-            summary_parts = format_region_summary(region, region_details)
-            
-            for part in summary_parts:
-                out = part
-                if AUTO_TRANSLATE and _needs_translation(out, MAX_NOTIFY_CHARS):
-                    try:
-                        out = translate_compact_html(out, target_lang="ru", max_len=MAX_NOTIFY_CHARS)
-                    except Exception:
-                        out = part
-                out = _sanitize_telegram_html(out)
-                
-                for cid in recipients:
-                    await _send_html(app, cid, out)
-                    # Задержка между сообщениями
-                    await asyncio.sleep(0.5)
-            
-            # Задержка между регионами
-            await asyncio.sleep(1.0)
+            if pending and pending_len + len(_PART_SEP) + len(out) > telegram_notify.MAX_LEN:
+                await _broadcast_html(app, recipients, _PART_SEP.join(pending))
+                pending, pending_len = [], 0
+            pending_len += len(out) + (len(_PART_SEP) if pending else 0)
+            pending.append(out)
+        if pending:
+            await _broadcast_html(app, recipients, _PART_SEP.join(pending))
 
     except Exception as e:
         log.error("daily job error: %s", e, exc_info=True)
@@ -217,6 +267,9 @@ def run_bot():
     _load_env()
     _setup_logging()
     _tune_lib_loggers()
+    # получатели и dev-чат разбираются один раз, сразу после .env (дальше — из lru_cache)
+    _parse_chat_ids()
+    _dev_id()
     
     # Проверяем и логируем конфигурацию прокси
     from ..config import validate_proxy_config
@@ -244,11 +297,25 @@ def run_bot():
     async def _post_init(application: Application):
         await application.bot.set_my_commands(commands)
 
+    async def _post_shutdown(application: Application):
+        await aclose_http_clients()
+        await telegram_notify.aclose()
+
     app.post_init = _post_init
+    app.post_shutdown = _post_shutdown
     _schedule_daily(app)
 
+    # Long polling: getUpdates висит до TG_POLL_TIMEOUT с, пока нет апдейтов — в простое
+    # ~2 запроса в минуту вместо ~6 (по умолчанию PTB — 10 с); TG_POLL_INTERVAL — пауза между запросами
+    poll_timeout = int(os.getenv("TG_POLL_TIMEOUT", "30"))
+    poll_interval = float(os.getenv("TG_POLL_INTERVAL", "0"))
+
     log.info("Бот запущен. Ожидаю команды…")
-    app.run_polling(allowed_updates=["message", "callback_query"])
+    app.run_polling(
+        allowed_updates=["message", "callback_query"],
+        poll_interval=poll_interval,
+        timeout=poll_timeout,
+    )
 
 if __name__ == "__main__":
     run_bot()
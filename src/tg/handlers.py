@@ -4,7 +4,7 @@ import os
 import asyncio
 from html import escape
 import re
-from collections import defaultdict
+from collections import Counter
 from typing import Dict, List, Tuple
 
 from telegram import (
@@ -13,29 +13,55 @@ from telegram import (
     InlineKeyboardMarkup,
     Message,
 )
+from telegram.error import RetryAfter
 from telegram.ext import (
     ContextTypes,
     CommandHandler,
     CallbackQueryHandler,
 )
 
-from ..storage import load_cache
+from ..storage import load_cache, cache_stamp
 from ..pipeline import run_update, get_stats
 from ..llm_client import translate_compact_html  # автоперевод/сжатие
-from ..smart_formatter import format_change_smart  # умное форматирование
+from ..smart_formatter import format_changes_batch  # умное форматирование
 
 log = logging.getLogger(__name__)
 
+_UNSUPPORTED_TAG_RE = re.compile(r'</?(?:div|span|p|br|hr|ul|ol|li|table|tr|td|th|thead|tbody|h[1-6]|img|form|input|button|script|style)[^>]*>', re.IGNORECASE)
+_H_CLOSE_RE = re.compile(r'</h[1-6]>', re.IGNORECASE)
+_H_DIGITS = "123456"
+
 # Функция для очистки HTML от неподдерживаемых Telegram тегов
 def _sanitize_telegram_html(html: str) -> str:
     """Удаляет или заменяет HTML теги, не поддерживаемые Telegram.
     Telegram поддерживает только: <b>, <i>, <u>, <s>, <a>, <code>, <pre>
     """
-    # Заменяем h1-h6 на bold
-    html = re.sub(r'<h[1-6]>(.*?)</h[1-6]>', r'<b>\1</b>', html, flags=re.IGNORECASE | re.DOTALL)
-    # Убираем неподдерживаемые теги (НЕ трогаем b, i, u, s, a, code, pre)
-    html = re.sub(r'</?(?:div|span|p|br|hr|ul|ol|li|table|tr|td|th|thead|tbody|h[1-6]|img|form|input|button|script|style)[^>]*>', '', html, flags=re.IGNORECASE)
-    return html
+    if "<" not in html:
+        return html  # тегов нет — чистить нечего
+
+    # Один проход по тегам: неподдерживаемые убираем (НЕ трогаем b, i, u, s, a, code, pre),
+    # голые <hN>…</hM> заменяем на <b>…</b> (открывающий — только если дальше есть закрывающий)
+    in_heading = False
+    last_close = None  # позиция последнего </hN> в тексте; ищем лениво, при первом <hN>
+
+    def _repl(m) -> str:
+        nonlocal in_heading, last_close
+        tag = m.group(0)
+        if len(tag) == 4 and tag[1] in "hH" and tag[2] in _H_DIGITS:  # <hN>
+            if in_heading:
+                return ""
+            if last_close is None:
+                last_close = max((c.start() for c in _H_CLOSE_RE.finditer(html)), default=-1)
+            if last_close > m.start():
+                in_heading = True
+                return "<b>"
+            return ""
+        if in_heading and len(tag) == 5 and tag[1] == "/" and tag[2] in "hH" and tag[3] in _H_DIGITS:  # </hN>
+            in_heading = False
+            return "</b>"
+        return ""
+
+    return _UNSUPPORTED_TAG_RE.sub(_repl, html)
 
 CATS = {
     "news_policy": ("⚖", "Политика"),
@@ -47,24 +73,49 @@ CATS = {
 }
 ALL_TAG = "all"
 
-_last_pages: Dict[int, List[int]] = defaultdict(list)
+# Состояние по чатам (id сообщений для последующего удаления). Размер ограничен CHAT_STATE_MAX:
+# при переполнении забываем самые давно активные чаты (их старые сообщения просто не удалятся)
+CHAT_STATE_MAX = int(os.getenv("CHAT_STATE_MAX", "10000"))
+_last_pages: Dict[int, List[int]] = {}
 _last_menu: Dict[int, int] = {}
 _tips: Dict[int, int] = {}
 
+def _remember(store: dict, chat_id: int, value) -> None:
+    """store[chat_id] = value с переносом чата в конец (dict хранит порядок вставки) и вытеснением старых."""
+    store.pop(chat_id, None)
+    store[chat_id] = value
+    while len(store) > CHAT_STATE_MAX:
+        del store[next(iter(store))]
+
 AUTO_TRANSLATE = os.getenv("AUTO_TRANSLATE_DIFFS", "1") == "1"
 MAX_NOTIFY_CHARS = int(os.getenv("MAX_NOTIFY_CHARS", "1400"))
+# Сколько переводов (запросов к LLM) идёт одновременно — общий лимит процесса:
+# ручные обновления здесь и ежедневная рассылка в bot.py
+TRANSLATE_CONCURRENCY = int(os.getenv("TRANSLATE_CONCURRENCY", "4"))
+_TRANSLATE_SEM = asyncio.Semaphore(TRANSLATE_CONCURRENCY)
 DEV_ID = int(os.getenv("TELEGRAM_DEV_CHAT_ID", "527824690") or "0")
 
+# Записи и счётчики для меню/страниц — пересчитываем, только когда изменился cache.json.
+# Возвращаемые список и dict общие: вызывающие их только читают
+_ITEMS_MEM = {"stamp": None, "items": None, "counts": None}
+
 def _items() -> List[dict]:
+    stamp = cache_stamp()
+    if stamp is not None and stamp == _ITEMS_MEM["stamp"]:
+        return _ITEMS_MEM["items"]
     data = load_cache() or {}
     items = data.get("items", [])
-    return [x for x in items if isinstance(x, dict) and x.get("tag") and x.get("url")]
+    items = [x for x in items if isinstance(x, dict) and x.get("tag") and x.get("url")]
+    _ITEMS_MEM.update(stamp=stamp, items=items, counts=None)
+    return items
 
 def _count_by_tag(items: List[dict]) -> Dict[str, int]:
-    d: Dict[str, int] = defaultdict(int)
-    for it in items:
-        d[it.get("tag", "")] += 1
+    if items is _ITEMS_MEM["items"] and _ITEMS_MEM["counts"] is not None:
+        return _ITEMS_MEM["counts"]
+    d: Dict[str, int] = Counter(it.get("tag", "") for it in items)
     d[ALL_TAG] = len(items)
+    if items is _ITEMS_MEM["items"]:
+        _ITEMS_MEM["counts"] = d
     return d
 
 def _build_menu(counts: Dict[str, int]) -> InlineKeyboardMarkup:
@@ -92,6 +143,14 @@ _MAX_MAIN = 150
 _MAX_BULLETS = 3
 _MAX_BULLET_LEN = 120
 _SENT_SPLIT = re.compile(r"(?<=[.!?])\s+")
+_SENT_TRIM = "–—-:;•· "          # обрамление предложения (тире, маркеры списков)
+_BULLET_MARKS = ("-", "•", "—", "*")
+_BULLET_TRIM = "-•—* "
+# шум, не влияющий на значимость изменения: даты («5 Jan 2024», «12 марта 2025») и версии (v1.0, 2.3.4).
+# Порядок важен: сначала даты, потом версии — в «version 2.1 march 2025» «1 march 2025» — дата,
+# а общая альтернатива съела бы «2.1» как версию и дату бы не тронула
+_DATE_RE = re.compile(r'\b\d{1,2}\s+(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec|янв|фев|мар|апр|май|июн|июл|авг|сен|окт|ноя|дек)[a-zа-я]*\s+\d{4}\b')
+_VERSION_RE = re.compile(r'\bv?\d+\.\d+(?:\.\d+)?\b')
 
 def _clip(s: str, n: int) -> str:
     s = (s or "").strip()
@@ -99,25 +158,31 @@ def _clip(s: str, n: int) -> str:
         return s
     return s[: max(0, n - 1)].rstrip() + "…"
 
+def _iter_sentences(text: str):
+    """Как _SENT_SPLIT.split(text), но лениво: нужны обычно 1–3 первых предложения."""
+    pos = 0
+    for m in _SENT_SPLIT.finditer(text):
+        yield text[pos:m.start()]
+        pos = m.end()
+    yield text[pos:]
+
 def _first_sentence(text: str) -> str:
     text = (text or "").strip()
     if not text:
         return ""
-    parts = _SENT_SPLIT.split(text)
-    for p in parts:
-        p = p.strip("–—-:;•· ").strip()
+    for p in _iter_sentences(text):
+        p = p.strip(_SENT_TRIM).strip()
         if len(p) >= 15:
             return p
     return text
 
 def _extract_bullets(summary: str) -> list[str]:
-    lines = [ln.strip() for ln in (summary or "").splitlines()]
-    bulletish = [ln for ln in lines if ln.startswith(("-", "•", "—", "*"))]
-    cleaned = [ln.lstrip("-•—* ").strip() for ln in bulletish if ln]
+    # строки уже без пробелов по краям — после снятия маркера остаётся убрать пробелы слева
+    lines = map(str.strip, (summary or "").splitlines())
+    cleaned = [ln.lstrip(_BULLET_TRIM).lstrip() for ln in lines if ln.startswith(_BULLET_MARKS)]
     if not cleaned:
-        parts = _SENT_SPLIT.split(summary or "")
-        parts = [p.strip() for p in parts if 10 <= len(p.strip()) <= _MAX_BULLET_LEN + 20]
-        cleaned = parts
+        parts = (p.strip() for p in _iter_sentences(summary or ""))
+        cleaned = (p for p in parts if 10 <= len(p) <= _MAX_BULLET_LEN + 20)
     out = []
     for ln in cleaned:
         if not ln:
@@ -134,15 +199,14 @@ def _pretty_item(it: dict) -> str:
     title = escape(_clip(raw_title, _MAX_TITLE))
 
     summary = (it.get("summary") or "").strip()
-    main = escape(_clip(_first_sentence(summary), _MAX_MAIN)) if summary else "—"
-    bullets = [f"• {escape(b)}" for b in _extract_bullets(summary)[:_MAX_BULLETS]]
+    if summary:
+        main = escape(_clip(_first_sentence(summary), _MAX_MAIN))
+        bullets = "".join(f"\n• {escape(b)}" for b in _extract_bullets(summary)[:_MAX_BULLETS])
+    else:
+        main, bullets = "—", ""
     url = escape((it.get("url") or "").strip())
 
-    lines = [f"{emo} <b>{title}</b>", main]
-    if bullets:
-        lines.extend(bullets)
-    lines.append(f"🔗 <a href=\"{url}\">Подробнее</a>")
-    return "\n".join(lines)
+    return f"{emo} <b>{title}</b>\n{main}{bullets}\n🔗 <a href=\"{url}\">Подробнее</a>"
 
 def _safe_join(blocks: List[str], hard_limit: int = 3500) -> Tuple[str, int]:
     out, used, total = [], 0, 0
@@ -153,13 +217,24 @@ def _safe_join(blocks: List[str], hard_limit: int = 3500) -> Tuple[str, int]:
         out.append(b); total += need; used += 1
     return ("\n\n".join(out) if out else "⚠️ В этой категории пока нет данных."), used
 
+_DELETE_BATCH = 100  # лимит deleteMessages (Bot API 7.0)
+
 async def _delete_msgs(chat_id: int, context: ContextTypes.DEFAULT_TYPE, ids: List[int]):
-    while ids:
-        mid = ids.pop()
-        try:
-            await context.bot.delete_message(chat_id=chat_id, message_id=mid)
-        except Exception:
-            pass
+    """Удаляет сообщения одним deleteMessages на каждые 100 id; ids очищается (как и раньше)."""
+    if not ids:
+        return
+    batch = list(ids)
+    ids.clear()
+    try:
+        for i in range(0, len(batch), _DELETE_BATCH):
+            await context.bot.delete_messages(chat_id=chat_id, message_ids=batch[i:i + _DELETE_BATCH])
+        return
+    except Exception:
+        pass  # нет метода / сбой пакета — удаляем поштучно, параллельно
+    await asyncio.gather(
+        *(context.bot.delete_message(chat_id=chat_id, message_id=mid) for mid in batch),
+        return_exceptions=True,
+    )
 
 async def _delete_old_pages(chat_id: int, context: ContextTypes.DEFAULT_TYPE):
     await _delete_msgs(chat_id, context, _last_pages.get(chat_id, []))
@@ -174,7 +249,7 @@ async def _send_tip(update: Update) -> None:
     if not q:
         return
     m = await q.message.reply_text("⏳ Формирую страницу…")
-    _tips[q.message.chat_id] = m.message_id
+    _remember(_tips, q.message.chat_id, m.message_id)
 
 async def _clear_tip(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     q = update.callback_query
@@ -225,7 +300,10 @@ async def _send_page(update: Update, context: ContextTypes.DEFAULT_TYPE, tag: st
         reply_markup=kb,
         disable_web_page_preview=True,
     )
-    _last_pages[chat_id].append(m.message_id)
+    # список очищен _delete_old_pages выше; не пуст лишь при параллельной отправке страниц в этот чат
+    pages = _last_pages.get(chat_id) or []
+    pages.append(m.message_id)
+    _remember(_last_pages, chat_id, pages)
 
 async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat_id = update.effective_chat.id
@@ -234,7 +312,7 @@ async def cmd_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     kb = _build_menu(counts)
     await _delete_old_menu(chat_id, context)
     m = await update.message.reply_text("Выберите категорию:", reply_markup=kb)
-    _last_menu[chat_id] = m.message_id
+    _remember(_last_menu, chat_id, m.message_id)
 
 async def cmd_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await cmd_start(update, context)
@@ -262,6 +340,22 @@ async def cmd_status(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"Размер страницы: {s['page_size']}\n"
     )
 
+def _norm(s: str) -> str:
+    # strip + схлопывание пробельных символов (\s+ → " ") через split/join
+    return " ".join((s or "").split())
+
+def _norm_escape(s: str) -> str:
+    """Нормализованная и HTML-экранированная строка diff'а."""
+    return escape(" ".join((s or "").split()))
+
+def _is_space_equal(a: str, b: str) -> bool:
+    return (a or "").replace(" ", "") == (b or "").replace(" ", "")
+
+def _pair_contains(p_big: Tuple[str, str], p_small: Tuple[str, str]) -> bool:
+    aw, an = p_big
+    bw, bn = p_small
+    return (bw in aw and bn in an) or (aw in bw and an in bn)
+
 def _format_detailed_diff(detail: dict) -> List[str]:
     H_LIMIT = 3500
     title = escape(detail.get("title", "") or detail.get("url", ""))
@@ -269,35 +363,28 @@ def _format_detailed_diff(detail: dict) -> List[str]:
     blocks: List[str] = []
 
     header = f"• <b>{title}</b>"
-    cur = header
+    # текущий блок — список строк и его длина с учётом "\n"; склеиваем один раз при сбросе
+    cur_parts: List[str] = [header]
+    cur_len = len(header)
 
-    def _flush():
-        nonlocal cur
+    def _flush(tail: str = ""):
+        nonlocal cur_parts, cur_len
+        cur = "\n".join(cur_parts) + tail
         if cur.strip():
             blocks.append(cur)
-        cur = ""
+        cur_parts, cur_len = [], 0
 
     def _append(line: str):
-        nonlocal cur
-        add = ("\n" if cur else "") + line
-        if len(cur) + len(add) > H_LIMIT:
+        nonlocal cur_parts, cur_len
+        if not cur_len:
+            # пустой блок: строка становится его началом (пустая строка блок не открывает)
+            cur_parts, cur_len = [line], len(line)
+        elif cur_len + 1 + len(line) > H_LIMIT:
             _flush()
-            cur = line
+            cur_parts, cur_len = [line], len(line)
         else:
-            cur += add
-
-    def _norm(s: str) -> str:
-        s = (s or "").strip()
-        s = re.sub(r"\s+", " ", s)
-        return s
-
-    def _is_space_equal(a: str, b: str) -> bool:
-        return (a or "").replace(" ", "") == (b or "").replace(" ", "")
-
-    def _pair_contains(p_big: Tuple[str, str], p_small: Tuple[str, str]) -> bool:
-        aw, an = p_big
-        bw, bn = p_small
-        return (bw in aw and bn in an) or (aw in bw and an in bn)
+            cur_parts.append(line)
+            cur_len += 1 + len(line)
 
     section_pairs = []
     for s in (detail.get("section_diffs") or []):
@@ -313,6 +400,10 @@ def _format_detailed_diff(detail: dict) -> List[str]:
     removed = gd.get("removed") or []
     added   = gd.get("added") or []
 
+    # точные дубли секционных пар — частый случай — отсекаем поиском в множестве,
+    # попарную проверку вхождения делаем только для остальных
+    section_exact = set(section_pairs)
+
     filtered_changed: List[Tuple[str, str]] = []
     for pair in changed:
         was = _norm(pair.get("was", ""))
@@ -321,6 +412,8 @@ def _format_detailed_diff(detail: dict) -> List[str]:
             continue
         if _is_space_equal(was, now):
             continue
+        if (was, now) in section_exact:
+            continue
         dup = False
         for sp in section_pairs:
             if _pair_contains((was, now), sp):
@@ -338,11 +431,11 @@ def _format_detailed_diff(detail: dict) -> List[str]:
         if added:
             _append("➕ <b>Добавлено:</b>")
             for ln in added:
-                _append(f"— {escape(_norm(ln))}")
+                _append(f"— {_norm_escape(ln)}")
         if removed:
             _append("➖ <b>Удалено:</b>")
             for ln in removed:
-                _append(f"— {escape(_norm(ln))}")
+                _append(f"— {_norm_escape(ln)}")
 
     for s in (detail.get("section_diffs") or []):
         typ = s.get("type")
@@ -350,11 +443,11 @@ def _format_detailed_diff(detail: dict) -> List[str]:
         if typ == "added":
             _append("➕ <b>Добавлено:</b>")
             for ln in s.get("added", []):
-                _append(f"— {escape(_norm(ln))}")
+                _append(f"— {_norm_escape(ln)}")
         elif typ == "removed":
             _append("➖ <b>Удалено:</b>")
             for ln in s.get("removed", []):
-                _append(f"— {escape(_norm(ln))}")
+                _append(f"— {_norm_escape(ln)}")
         elif typ == "changed":
             _append(f"✏️ <b>Изменено:</b> ({ttl})")
             for pair in s.get("changed", []):
@@ -365,27 +458,32 @@ def _format_detailed_diff(detail: dict) -> List[str]:
                 _append(f"— Было: “{escape(was)}”")
                 _append(f"— Стало: “{escape(now)}”")
             for ln in s.get("removed_inline", []):
-                _append(f"— Было (доп.): “{escape(_norm(ln))}”")
+                _append(f"— Было (доп.): “{_norm_escape(ln)}”")
             for ln in s.get("added_inline", []):
-                _append(f"— Стало (доп.): “{escape(_norm(ln))}”")
+                _append(f"— Стало (доп.): “{_norm_escape(ln)}”")
 
     tail = f"\n🔗 {url}" if url else ""
-    if len(cur) + len(tail) > H_LIMIT:
+    if cur_len + len(tail) > H_LIMIT:
         _flush()
         if tail.strip():
             blocks.append(tail.strip())
     else:
-        cur += tail
-        _flush()
+        _flush(tail)
 
     return blocks
 
+_ASCII_LETTERS = bytes(range(65, 91)) + bytes(range(97, 123))
+
 def _needs_translation(s: str) -> bool:
     if not AUTO_TRANSLATE:
         return False
-    en = len(re.findall(r"[A-Za-z]", s))
-    total = max(1, len(s))
-    return en / total > 0.15 or len(s) > MAX_NOTIFY_CHARS
+    if len(s) > MAX_NOTIFY_CHARS:
+        return True  # длинное — сжимаем в любом случае, буквы не считаем
+    # Число латинских букв без списка совпадений: удаляем их из UTF-8 байтов и смотрим разницу длин
+    # (байты многобайтовых символов ≥ 0x80 с A-Z/a-z не пересекаются)
+    b = s.encode("utf-8", "ignore")
+    en = len(b) - len(b.translate(None, _ASCII_LETTERS))
+    return en / max(1, len(s)) > 0.15
 
 def _is_meaningful_change(detail: dict) -> bool:
     """
@@ -403,20 +501,21 @@ def _is_meaningful_change(detail: dict) -> bool:
     
     # Анализируем изменения
     for pair in changed:
-        was = (pair.get("was", "") or "").lower()
-        now = (pair.get("now", "") or "").lower()
-        
-        # Убираем даты из сравнения
-        was_no_dates = re.sub(r'\b\d{1,2}\s+(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec|янв|фев|мар|апр|май|июн|июл|авг|сен|окт|ноя|дек)[a-zа-я]*\s+\d{4}\b', '', was)
-        now_no_dates = re.sub(r'\b\d{1,2}\s+(?:jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec|янв|фев|мар|апр|май|июн|июл|авг|сен|окт|ноя|дек)[a-zа-я]*\s+\d{4}\b', '', now)
-        
-        # Убираем версии (v1.0, version 2, etc)
-        was_no_ver = re.sub(r'\bv?\d+\.\d+(?:\.\d+)?\b', '', was_no_dates)
-        now_no_ver = re.sub(r'\bv?\d+\.\d+(?:\.\d+)?\b', '', now_no_dates)
+        was = pair.get("was", "") or ""
+        now = pair.get("now", "") or ""
+        # Дешёвые отсевы до regex: одинаковый текст и слишком короткое «стало»
+        # (очистка только укорачивает строку) значимыми не бывают
+        if was == now:
+            continue
+        now = now.lower()
+        if len(now) <= 10:
+            continue
+        was = was.lower()
         
-        # Убираем лишние пробелы
-        was_clean = re.sub(r'\s+', ' ', was_no_ver).strip()
-        now_clean = re.sub(r'\s+', ' ', now_no_ver).strip()
+        # Убираем даты, затем версии (v1.0, version 2, etc), затем лишние пробелы
+        # (split/join по пробельным символам = \s+ → ' ' и strip)
+        was_clean = " ".join(_VERSION_RE.sub('', _DATE_RE.sub('', was)).split())
+        now_clean = " ".join(_VERSION_RE.sub('', _DATE_RE.sub('', now)).split())
         
         # Если после очистки тексты разные - изменение значимое
         if was_clean != now_clean and len(now_clean) > 10:
@@ -424,39 +523,85 @@ def _is_meaningful_change(detail: dict) -> bool:
     
     return False
 
-async def cmd_refresh(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    tip = await update.message.reply_text("⏳ Обновляю источники…")
-    res = await run_update()
-    try:
-        await context.bot.delete_message(update.effective_chat.id, tip.message_id)
-    except Exception:
-        pass
+async def _prepare_part(p: str) -> str:
+    """Перевод/сжатие (в потоке, при необходимости) и чистка HTML одной части."""
+    out = p
+    if _needs_translation(out):
+        try:
+            async with _TRANSLATE_SEM:
+                out = await asyncio.to_thread(translate_compact_html, out, target_lang="ru", max_len=MAX_NOTIFY_CHARS)
+        except Exception:
+            out = p
+    return _sanitize_telegram_html(out)
 
-    details = res.get("details") or []
+async def _prepare_messages(details: List[dict]) -> List[str]:
+    """
+    Готовые к отправке сообщения по изменениям, в исходном порядке.
+    Форматирование (CPU) — в рабочем потоке, не блокируя event loop; части — параллельно
+    (переводы — не более TRANSLATE_CONCURRENCY разом).
+    """
+    batches = await asyncio.to_thread(format_changes_batch, details)
+    return list(await asyncio.gather(*(_prepare_part(p) for parts in batches for p in parts)))
+
+# Пауза между ответами в интерактивном чате (/refresh, кнопки). Намеренно не темп рассылки
+# TG_CHAT_MIN_INTERVAL (1 с): пользователь ждёт ответ, а от флуда защищает повтор по 429
+TG_REPLY_MIN_INTERVAL = float(os.getenv("TG_REPLY_MIN_INTERVAL", "0.05"))
+
+async def _send_in_order(texts: List[str], send) -> int:
+    """
+    Отправляет тексты в один чат строго по порядку через send(text).
+    Между сообщениями — короткая пауза TG_REPLY_MIN_INTERVAL, 429 — один повтор по retry_after.
+    """
+    sent = 0
+    for text in texts:
+        if sent and TG_REPLY_MIN_INTERVAL > 0:
+            await asyncio.sleep(TG_REPLY_MIN_INTERVAL)
+        for attempt in range(2):
+            try:
+                await send(text)
+                sent += 1
+                break
+            except RetryAfter as e:
+                if attempt:
+                    raise
+                ra = e.retry_after
+                await asyncio.sleep(ra.total_seconds() if hasattr(ra, "total_seconds") else float(ra))
+    return sent
+
+async def _dispatch_details(details: List[dict], send) -> int:
+    """
+    Общий конвейер ручных рассылок: форматирование → перевод → чистка HTML → отправка
+    по порядку в один чат через send(text). Возвращает число отправленных сообщений.
+    """
+    outs = await _prepare_messages(details)
+    return await _send_in_order(outs, send)
+
+async def _report_details(message: Message, details: List[dict]) -> None:
+    """Итог обновления для /refresh и кнопки «Обновить»: счётчики и значимые изменения — в чат сообщения."""
     # Фильтруем только значимые изменения
     meaningful_details = [d for d in details if _is_meaningful_change(d)]
-    
+
     msg = f"✅ Обновление завершено.\nВсего изменений: {len(details)}\nЗначимых для таргетинга: {len(meaningful_details)}"
-    await update.message.reply_text(msg)
+    await message.reply_text(msg)
 
     if not meaningful_details:
-        await update.message.reply_text("🟢 Все изменения незначительные (обновление дат, версий, и т.д.)")
+        await message.reply_text("🟢 Все изменения незначительные (обновление дат, версий, и т.д.)")
         return
 
-    for d in meaningful_details:
-        # Используем умное форматирование
-        parts = format_change_smart(d)
-        for p in parts:
-            out = p
-            if _needs_translation(out):
-                try:
-                    out = translate_compact_html(out, target_lang="ru", max_len=MAX_NOTIFY_CHARS)
-                except Exception:
-                    out = p
-            out = _sanitize_telegram_html(out)
-            await update.message.reply_html(out, disable_web_page_preview=True)
-            # Задержка для избежания flood control
-            await asyncio.sleep(0.05)
+    await _dispatch_details(
+        meaningful_details,
+        lambda t: message.reply_html(t, disable_web_page_preview=True),
+    )
+
+async def cmd_refresh(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    tip = await update.message.reply_text("⏳ Обновляю источники…")
+    res = await run_update()
+    try:
+        await context.bot.delete_message(update.effective_chat.id, tip.message_id)
+    except Exception:
+        pass
+
+    await _report_details(update.message, res.get("details") or [])
 
 async def on_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
     q = update.callback_query
@@ -471,7 +616,7 @@ async def on_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
             await _delete_old_menu(chat_id, context)
             await _delete_old_pages(chat_id, context)
             m = await q.message.reply_text("Выберите категорию:", reply_markup=kb)
-            _last_menu[chat_id] = m.message_id
+            _remember(_last_menu, chat_id, m.message_id)
 
         elif data.startswith("cat:"):
             tag = data.split(":", 1)[1]
@@ -488,31 +633,7 @@ async def on_button(update: Update, context: ContextTypes.DEFAULT_TYPE):
         elif data == "refresh":
             await q.answer("⏳ Обновляю…", show_alert=False)
             res = await run_update()
-            
-            details = res.get("details") or []
-            # Фильтруем только значимые изменения
-            meaningful_details = [d for d in details if _is_meaningful_change(d)]
-            
-            msg = f"✅ Обновление завершено.\nВсего изменений: {len(details)}\nЗначимых для таргетинга: {len(meaningful_details)}"
-            await q.message.reply_text(msg)
-
-            if not meaningful_details:
-                await q.message.reply_text("🟢 Все изменения незначительные (обновление дат, версий, и т.д.)")
-            else:
-                for d in meaningful_details:
-                    # Используем умное форматирование
-                    parts = format_change_smart(d)
-                    for p in parts:
-                        out = p
-                        if _needs_translation(out):
-                            try:
-                                out = translate_compact_html(out, target_lang="ru", max_len=MAX_NOTIFY_CHARS)
-                            except Exception:
-                                out = p
-                        out = _sanitize_telegram_html(out)
-                        await q.message.reply_html(out, disable_web_page_preview=True)
-                        # Задержка для избежания flood control
-                        await asyncio.sleep(0.05)
+            await _report_details(q.message, res.get("details") or [])
 
         elif data == "status":
             s = get_stats()
@@ -549,22 +670,10 @@ async def cmd_testdispatch(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("Готово: значимых изменений не было.")
         return
 
-    sent = 0
-    for d in meaningful_details:
-        # Используем умное форматирование
-        parts = format_change_smart(d)
-        for p in parts:
-            out = p
-            if _needs_translation(out):
-                try:
-                    out = translate_compact_html(out, target_lang="ru", max_len=MAX_NOTIFY_CHARS)
-                except Exception:
-                    out = p
-            out = _sanitize_telegram_html(out)
-            await context.bot.send_message(chat_id=DEV_ID, text=out, parse_mode="HTML", disable_web_page_preview=True)
-            # Задержка для избежания flood control
-            await asyncio.sleep(0.05)
-            sent += 1
+    sent = await _dispatch_details(
+        meaningful_details,
+        lambda t: context.bot.send_message(chat_id=DEV_ID, text=t, parse_mode="HTML", disable_web_page_preview=True),
+    )
     
     await update.message.reply_text(f"Готово: {len(details)} изменений, {len(meaningful_details)} значимых, {sent} сообщений отправлено.")
 
@@ -10,7 +10,7 @@ import httpx
 import sys
 sys.path.append(os.path.dirname(__file__))
 
-from src.pipeline import _get_proxy_for_region, _get_random_headers, _fix_facebook_url
+from src.pipeline import _get_proxy_for_region, _get_random_headers, _fix_facebook_url, _is_meta_site
 
 async def test_422_handling():
     print("🧪 ТЕСТИРОВАНИЕ ОБРАБОТКИ 422 СТАТУСА")
@@ -56,7 +56,7 @@ async def test_422_handling():
                     # Точно та же логика как в pipeline
                     html = None
                     if response.status_code == 422:
-                        is_meta_site = any(domain in processed_url for domain in ["transparency.meta.com", "facebook.com", "about.fb.com", "developers.facebook.com"])
+                        is_meta_site = _is_meta_site(processed_url)
                         if is_meta_site and response.text and len(response.text.strip()) > 100:
                             print(f"   ✅ Meta сайт: Статус 422 но получен HTML ({len(response.text)} симв.), продолжаем")
                             html = response.text
@@ -182,7 +182,7 @@ async def test_4_pipeline_components(results: FullTestResults):
     try:
         # Проверяем что pipeline компоненты работают
         from src.storage import load_cache, save_cache, compute_hash
-        from src.html_clean import clean_html
+        from src.html_clean import clean_html_soup
         from src.summarize import normalize_plain, extract_sections
         
         # Тестируем загрузку кэша
@@ -191,7 +191,7 @@ async def test_4_pipeline_components(results: FullTestResults):
         
         # Тестируем обработку HTML
         test_html = "<html><head><title>Test</title></head><body><p>Test content for Meta News Bot</p></body></html>"
-        title, plain, cleaned = clean_html(test_html, "https://example.com")
+        title, plain, soup = clean_html_soup(test_html, "https://example.com")
         
         if title and plain:
             results.pass_test("HTML обработка", f"Заголовок: '{title}', текст: {len(plain)} симв.")
@@ -209,7 +209,7 @@ async def test_4_pipeline_components(results: FullTestResults):
             results.pass_test("Хэширование", f"Хэш: {hash_value[:16]}...")
         
         # Тестируем извлечение секций
-        sections = extract_sections(cleaned)
+        sections = extract_sections(soup)
         results.pass_test("Извлечение секций", f"{len(sections)} секций")
         
         # Создаем тестовые данные для последующих тестов